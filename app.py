@@ -1,56 +1,198 @@
 import pygame
+import math
 import os
+import sys
+import time
 import random
-import csv
+import threading
+import zlib
+import numpy as np
+from assets import assets
 from button import button
+from leveldata import leveldata
+from profiler import profiler
+from replay import replay
+
+# headless -> dummy video driver, no blits and no frame cap
+HEADLESS = '--headless' in sys.argv
+# --build-assets packs every scaled image into atlases under imgs/atlas and exits
+BUILD_ASSETS = '--build-assets' in sys.argv
+if HEADLESS or BUILD_ASSETS:
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+# --record FILE saves the session's seed and input, --replay FILE plays one back
+RECORD_PATH = sys.argv[sys.argv.index('--record') + 1] if '--record' in sys.argv else None
+REPLAY_PATH = sys.argv[sys.argv.index('--replay') + 1] if '--replay' in sys.argv else None
+# --window WxH and --fullscreen show the frame scaled once to the window, by whole factors unless --smooth
+WINDOW_SIZE = tuple(int(v) for v in sys.argv[sys.argv.index('--window') + 1].split('x')) if '--window' in sys.argv else None
+FULLSCREEN = '--fullscreen' in sys.argv
+SMOOTH_SCALE = '--smooth' in sys.argv
+# --render-scale F draws the frame at F times 800x640 -> fewer pixels on weak machines, the world keeps its units
+RENDER_SCALE = float(sys.argv[sys.argv.index('--render-scale') + 1]) if '--render-scale' in sys.argv else 1
+if not 0 < RENDER_SCALE <= 1:
+    sys.exit('--render-scale must be above 0 and at most 1')
+# --quality N pins the quality level instead of adapting it to the frame time
+QUALITY_LEVEL = int(sys.argv[sys.argv.index('--quality') + 1]) if '--quality' in sys.argv else None
+# lowered quality changes the simulation and recordings do not store it -> only for windowed play
+if QUALITY_LEVEL is not None and (HEADLESS or RECORD_PATH or REPLAY_PATH):
+    sys.exit('--quality cannot be used with --headless, --record or --replay')
 
 pygame.init()
 
+# world units, the simulation and every image are sized for them
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = int(SCREEN_WIDTH * 0.8)
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+# internal render resolution, the frame everything is drawn into
+FRAME_WIDTH = round(SCREEN_WIDTH * RENDER_SCALE)
+FRAME_HEIGHT = round(SCREEN_HEIGHT * RENDER_SCALE)
+if WINDOW_SIZE is None and not FULLSCREEN and RENDER_SCALE == 1:
+    # frame is drawn straight onto the display
+    window = screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+else:
+    # fullscreen without a size -> the desktop resolution
+    window = pygame.display.set_mode(WINDOW_SIZE or ((0, 0) if FULLSCREEN else (SCREEN_WIDTH, SCREEN_HEIGHT)),
+                                     pygame.FULLSCREEN if FULLSCREEN else 0)
+    # offscreen frame in the display's pixel format
+    screen = pygame.Surface((FRAME_WIDTH, FRAME_HEIGHT)).convert()
 pygame.display.set_caption('Game')
 
-# framerate limit
+# framerate limit, 0 -> render as fast as the hardware allows
 clock = pygame.time.Clock()
 FPS = 60
+# fixed simulation rate, independent of the render rate
+SIM_RATE = 60
+SIM_DT = 1 / SIM_RATE
+# longest frame fed to the simulation -> avoids a spiral of catch-up ticks
+MAX_FRAME_TIME = 0.25
+# simulation ticks since startup, drives animation timers
+sim_ticks = 0
 
 # game variables
 GRAVITY = 0.4
 SCALE = 2
 ROWS = 16
-COLS = 150
 TILE_SIZE = SCREEN_HEIGHT // ROWS
 TILE_TYPES = 21
 SCROLL_THRESHOLD = 200
+# levels stream in chunks of CHUNK_COLS columns, static terrain and decorations pre-rendered per chunk
+BAKE_TILES = True
+CHUNK_COLS = 16
+# chunks load within STREAM_MARGIN of the view and are released once past RELEASE_MARGIN
+STREAM_MARGIN = 2 * SCREEN_WIDTH
+RELEASE_MARGIN = 3 * SCREEN_WIDTH
+# entities wake within WAKE_MARGIN of the view and sleep once past SLEEP_MARGIN
+WAKE_MARGIN = SCREEN_WIDTH // 2
+SLEEP_MARGIN = SCREEN_WIDTH
+# enemies chase a player this close if the flow field has a way down to them
+CHASE_RANGE = 8 * TILE_SIZE
+# a checkpoint is taken when the player first stands past every CHECKPOINT_COLS columns
+CHECKPOINT_COLS = 50
+# pre-composite the sky layer with the background colour -> no full screen fill
+COMPOSITE_SKY = True
+# quality steps down once the average work time of the last QUALITY_WINDOW frames is over QUALITY_DOWN
+# of the frame budget, and back up under QUALITY_UP, only while playing live in a window
+ADAPTIVE_QUALITY = True
+QUALITY_WINDOW = 60
+QUALITY_DOWN = 0.9
+QUALITY_UP = 0.5
+# quality levels, each one keeps the savings of those below it
+SKIP_FAR_PARALLAX = 1  # layers slower than FAR_PARALLAX are not drawn
+SLOW_ANIMATION = 2  # animation timers advance every ANIMATION_STRIDE ticks
+THROTTLE_AI = 3  # enemies off screen think every AI_STRIDE ticks
+DROP_DECORATIONS = 4  # unbaked decorations are not drawn
+MAX_QUALITY_LEVEL = 4
+FAR_PARALLAX = 0.7
+# animation frames advance every 200ms worth of simulation ticks -> player and enemies share it
+ANIMATION_COOLDOWN = 200 * SIM_RATE // 1000
+ANIMATION_STRIDE = 2
+AI_STRIDE = 4
 MAX_LEVELS = 3
-screen_scroll = 0
-bg_scroll = 0
-level = 1
 start_game = False
+start_intro = False
+# every world's random stream comes from the session seed, replays bring their own
+playback = replay.load(REPLAY_PATH) if REPLAY_PATH else None
+seed = playback.seed if playback is not None else random.randrange(2 ** 32)
+level = playback.level if playback is not None else 1
+recorder = replay.Recording(seed, level) if RECORD_PATH and playback is None else None
+# checksum of every tick's state so far while recording or replaying -> a replay is checked all the way through
+session_digest = 0
+# game keys in recordings -> code 2 * index for a press, 2 * index + 1 for a release
+INPUT_KEYS = (pygame.K_a, pygame.K_d, pygame.K_w, pygame.K_s, pygame.K_SPACE, pygame.K_f)
+# restart from the level's start, respawn at its last checkpoint
+RESTART_CODE = 255
+RESPAWN_CODE = 254
+
+
+# prebuilt atlases, None until `python app.py --build-assets` has been run for these sources
+atlas = None
+
+def load_image(name, size=None):
+    '''
+    Image from the atlas, or loaded from its png and scaled to size when there is no atlas
+    '''
+    img = atlas.get(name) if atlas is not None else None
+    if img is None:
+        img = pygame.image.load(f'imgs/{name}.png')
+        if size is not None:
+            img = pygame.transform.scale(img, size)
+        img = img.convert_alpha()
+    render_image(img)
+    return img
+
+def px(value):
+    '''
+    World units -> frame pixels
+    '''
+    return round(value * RENDER_SCALE)
 
+# frame sized copies of the world sized images, made when the images are loaded
+render_images = {}
 
-#load images
-pine1 = pygame.image.load('imgs/background/pine1.png')
-pine2 = pygame.image.load('imgs/background/pine2.png')
-mountain = pygame.image.load('imgs/background/mountain.png')
-sky_cloud = pygame.image.load('imgs/background/sky_cloud.png')
-#button images
+def render_image(img):
+    '''
+    Copy of a world sized image scaled to the frame, the image itself at full scale
+    '''
+    if RENDER_SCALE == 1:
+        return img
+    scaled = render_images.get(img)
+    if scaled is None:
+        # rounded up -> neighbouring tiles never leave a gap
+        size = (math.ceil(img.get_width() * RENDER_SCALE), math.ceil(img.get_height() * RENDER_SCALE))
+        scaled = render_images[img] = pygame.transform.scale(img, size)
+    return scaled
+
+#button images -> all the first frame needs
 start_img = pygame.image.load('imgs/start_btn.png').convert_alpha()
 exit_img = pygame.image.load('imgs/exit_btn.png').convert_alpha()
 restart_img = pygame.image.load('imgs/restart_btn.png').convert_alpha()
 
-#store tiles in a list
+# everything else is loaded by the loader thread while the menu is shown
+pine1 = pine2 = mountain = sky_cloud = None
 img_list = []
-for x in range(TILE_TYPES):
-	img = pygame.image.load(f'imgs/tile/{x}.png')
-	img = pygame.transform.scale(img, (TILE_SIZE, TILE_SIZE))
-	img_list.append(img)
-health_box_img = pygame.image.load('imgs/icons/health_box.png').convert_alpha()
+item_boxes = {}
+effect_images = []
+# (image, position) per effect slot, rewritten in place -> drawing effects creates no objects for the collector
+effect_blits = []
 
-item_boxes = {
-	'Health'	: health_box_img
-}
+def load_images():
+    '''
+    Background, tile and icon images, from the atlas when it is up to date
+    '''
+    global atlas, pine1, pine2, mountain, sky_cloud
+    atlas = assets.load('imgs', TILE_SIZE)
+    pine1 = load_image('background/pine1')
+    pine2 = load_image('background/pine2')
+    mountain = load_image('background/mountain')
+    sky_cloud = load_image('background/sky_cloud')
+    #store tiles in a list
+    for x in range(TILE_TYPES):
+        img_list.append(load_image(f'tile/{x}', (TILE_SIZE, TILE_SIZE)))
+    item_boxes['Health'] = load_image('icons/health_box')
+    # effects are plain coloured blocks, one image per kind, only ever drawn -> sized for the frame
+    for size, color, *stats in EFFECT_KINDS:
+        img = pygame.Surface((max(1, px(size[0])), max(1, px(size[1])))).convert()
+        img.fill(color)
+        effect_images.append(img)
+    effect_blits.extend([None, [0, 0]] for i in range(EFFECT_CAPACITY))
 
 # define colors
 BG = (125,125,125)
@@ -66,28 +208,193 @@ FLOOR = 400
 moving_left = False
 moving_right = False
 
+class ParallaxLayer():
+    '''
+    Background layer wrapping around at its own scroll speed
+    '''
+    def __init__(self, image, speed, y):
+        # frame pixels from here on
+        self.image = render_image(image)
+        self.speed = speed
+        self.y = px(y)
+        self.width = self.image.get_width()
+
+    def draw(self, scroll):
+        # left edge of the copy covering the left side of the screen
+        x = -int(scroll * self.speed * RENDER_SCALE) % self.width - self.width
+        while x < FRAME_WIDTH:
+            if x + self.width > 0:
+                screen.blit(self.image, (x, self.y))
+            x += self.width
+
+def build_parallax():
+    '''
+    Background layers, furthest first
+    '''
+    if COMPOSITE_SKY:
+        sky = pygame.Surface((sky_cloud.get_width(), SCREEN_HEIGHT))
+        sky.fill(BG)
+        sky.blit(sky_cloud, (0, 0))
+        sky = sky.convert()
+    else:
+        sky = sky_cloud
+    return [
+        ParallaxLayer(sky, .2, 0),
+        ParallaxLayer(mountain, .6, SCREEN_HEIGHT - mountain.get_height() - 300),
+        ParallaxLayer(pine1, .8, SCREEN_HEIGHT - pine1.get_height() - 150),
+        ParallaxLayer(pine2, .9, SCREEN_HEIGHT - pine2.get_height()),
+    ]
+
 def draw_bg():
-    screen.fill(BG)
-    width = sky_cloud.get_width() # sky is shortest
-    for x in range(10): # loop background
-        screen.blit(sky_cloud,((x * width) - bg_scroll * .2, 0))
-        screen.blit(mountain, ((x * width) - bg_scroll * .6 ,SCREEN_HEIGHT - mountain.get_height() - 300))
-        screen.blit(pine1, ((x * width) - bg_scroll * .8 , SCREEN_HEIGHT - pine1.get_height() - 150))
-        screen.blit(pine2, ((x * width) - bg_scroll * .9, SCREEN_HEIGHT - pine2.get_height()))
-#function to reset level
-def reset_level():
-    enemy_group.empty()
-    item_box_group.empty()
-    decoration_group.empty()
-    water_group.empty()
-    exit_group.empty()
-
-    #create empty tile list
-    data = []
-    for row in range(ROWS):
-        r = [-1] * COLS
-        data.append(r)
-    return data
+    far = quality.level >= SKIP_FAR_PARALLAX
+    if not COMPOSITE_SKY or far:
+        screen.fill(BG)
+    for layer in parallax_layers:
+        if far and layer.speed < FAR_PARALLAX:
+            continue
+        layer.draw(camera.offset)
+def load_world(level):
+    '''
+    Build the world for a level from its compiled data
+    '''
+    return build_world(leveldata.load(f'level{level}_data.csv', CHUNK_COLS), (seed, level))
+
+def build_world(data, world_seed=None):
+    '''
+    Create the world, player and health bar for compiled level data
+    '''
+    world = World(data, world_seed)
+    # every level starts with the camera at its left edge
+    world.stream(0, SCREEN_WIDTH)
+    world.activate(0, SCREEN_WIDTH)
+    world.checkpoint((0, 0))
+    return world, world.player, world.health_bar
+
+class LevelPrefetcher():
+    '''
+    Builds the next level's world on a worker thread while the current one is played
+    '''
+    def __init__(self):
+        # off -> the next level is only built once it is reached
+        self.enabled = True
+        self.level = None
+        self.seed = None
+        self.thread = None
+        self.result = None
+
+    def start(self, level):
+        if not self.enabled or level > MAX_LEVELS or (level, seed) == (self.level, self.seed):
+            return
+        self.wait()
+        self.level = level
+        self.seed = seed
+        self.result = None
+        self.thread = threading.Thread(target=self.run, args=(level,), daemon=True)
+        self.thread.start()
+
+    def run(self, level):
+        self.result = load_world(level)
+
+    def take(self, level):
+        '''
+        Hand over the prefetched world, building it now if it was not prefetched
+        '''
+        result = None
+        if (level, seed) == (self.level, self.seed):
+            self.thread.join()
+            result = self.result
+        self.level = None
+        self.thread = None
+        self.result = None
+        if result is None:
+            result = load_world(level)
+        return result
+
+    def wait(self):
+        '''
+        Let a running build finish, pygame must not quit underneath it
+        '''
+        if self.thread is not None:
+            self.thread.join()
+
+class AssetLoader():
+    '''
+    Runs the startup steps on a worker thread while the menu is shown
+    '''
+    def __init__(self, steps):
+        self.steps = steps
+        self.done = 0
+        self.ready = False
+        self.error = None
+        self.thread = None
+
+    @property
+    def progress(self):
+        return self.done / len(self.steps)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            for step in self.steps:
+                step()
+                self.done += 1
+            self.ready = True
+        except Exception as error:
+            # raised again on the main thread
+            self.error = error
+
+    def wait(self):
+        '''
+        Block until every step has run
+        '''
+        if self.thread is not None:
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+# index number correlates to action number
+PLAYER_ANIMATIONS = ['idle', 'move', 'die', 'hit', 'attack', 'jump', 'slide', 'crouch']
+ENEMY_ANIMATIONS = ['idle', 'move', 'die', 'hit', 'attack']
+# animation frames shared across characters -> (char_type, scale): (frames, flipped frames)
+animation_cache = {}
+# levels are also built on the prefetch thread
+animation_lock = threading.Lock()
+
+def load_animations(char_type, scale):
+    '''
+    Load, scale and flip a character's animation frames once per process
+    '''
+    key = (char_type, scale)
+    with animation_lock:
+        if key not in animation_cache:
+            anime_types = PLAYER_ANIMATIONS if char_type == 'player' else ENEMY_ANIMATIONS
+            counts = atlas.frame_counts(char_type, scale) if atlas is not None else None
+            anime_list = []
+            flipped_list = []
+            for action, animation in enumerate(anime_types):
+                # reset temporary animation lists
+                temp_list = []
+                flipped_temp = []
+                if counts is not None:
+                    anime_count = counts[action]
+                else:
+                    anime_count = len(os.listdir(f'imgs/{char_type}/{animation}'))
+                for i in range(anime_count):
+                    img = atlas.get(f'{assets.animation_key(char_type, scale)}/{animation}/{i}') if counts is not None else None
+                    if img is None:
+                        img = assets.scaled(pygame.image.load(f'imgs/{char_type}/{animation}/{i}.png'), scale)
+                        img = img.convert_alpha()
+                    temp_list.append(img)
+                    flipped_temp.append(pygame.transform.flip(img, True, False))
+                    render_image(img)
+                    render_image(flipped_temp[-1])
+                anime_list.append(temp_list)
+                flipped_list.append(flipped_temp)
+            animation_cache[key] = (anime_list, flipped_list)
+        return animation_cache[key]
 
 class Character(pygame.sprite.Sprite):
     def __init__(self, char_type, x, y, scale, speed, hp):
@@ -106,52 +413,68 @@ class Character(pygame.sprite.Sprite):
         self.crouch = False
         self.slide = False
         self.in_air = True
+        # landed on solid ground this tick, in_air stays False when walking off a ledge
+        self.grounded = False
         self.flip = False
         # animation list and index
         self.anime_list = []
         self.frame = 0
         self.action = 0
-        # enemy ai variables
-        self.move_counter = 0
         self.attack_cd = 0
-        self.vision = pygame.Rect(0, 0, 20, 20)
-        self.idling = 0
-        self.idling_counter = 0
-        self.update_time = pygame.time.get_ticks()
-
-        # load all character animations
-        # index number correlates to action number
-        if char_type == "player":
-            anime_types = ['idle', 'move', 'die', 'hit', 'attack', 'jump', 'slide', 'crouch']
-        else:
-            anime_types = ['idle', 'move', 'die', 'hit', 'attack']
-        for animation in anime_types:
-            # reset temporary animation list
-            temp_list = []
-            # animation
-            anime_count = len(os.listdir(f'imgs/{self.char_type}/{animation}'))
-            for i in range(anime_count):
-                img = pygame.image.load(f'imgs/{self.char_type}/{animation}/{i}.png')
-                img = pygame.transform.scale(img, (int(img.get_width() * scale), int(img.get_height() * scale)))
-                temp_list.append(img)
-            self.anime_list.append(temp_list)
+        self.throw = False
+        self.throw_cd = 0
+        self.update_time = sim_ticks
 
+        # load all character animations, shared by every character of this type
+        self.anime_list, self.flipped_list = load_animations(char_type, scale)
         self.image = self.anime_list[self.action][self.frame]
+        self.flipped_image = self.flipped_list[self.action][self.frame]
 
         self.rect = self.image.get_rect()
         self.rect.center = (x, y)
+        # position at the start of the tick -> interpolated when drawing
+        self.prev_x = self.rect.x
+        self.prev_y = self.rect.y
         self.width = self.image.get_width()
         self.height = self.image.get_height()
 
+    def store_previous(self):
+        self.prev_x = self.rect.x
+        self.prev_y = self.rect.y
+
+    # everything a respawn puts back, the images follow from action and frame
+    STATE = ('alive', 'hit', 'speed', 'hp', 'direction', 'y_velocity', 'attack', 'jump', 'crouch', 'slide',
+             'in_air', 'grounded', 'flip', 'frame', 'action', 'attack_cd', 'throw', 'throw_cd', 'prev_x', 'prev_y')
+
+    def snapshot(self):
+        state = {name: getattr(self, name) for name in self.STATE}
+        state['rect'] = self.rect.copy()
+        state['update_time'] = self.update_time
+        return state
+
+    def restore(self, state, elapsed):
+        '''
+        Put back a snapshot taken elapsed ticks ago
+        '''
+        for name in self.STATE:
+            setattr(self, name, state[name])
+        self.rect = state['rect'].copy()
+        self.update_time = state['update_time'] + elapsed
+        self.image = self.anime_list[self.action][self.frame]
+        self.flipped_image = self.flipped_list[self.action][self.frame]
+
     def update(self):
         '''
         updates sprite animations
         '''
         self.check_alive()
-        self.update_anime()
+        if animation_due():
+            self.update_anime()
         # update cooldown for attacking
         if self.attack_cd > 0:
             self.attack_cd -= 1
+        if self.throw_cd > 0:
+            self.throw_cd -= 1
 
     def check_alive(self):
         '''
@@ -168,7 +491,6 @@ class Character(pygame.sprite.Sprite):
         Controls and moves character sprites along with collisions
         '''
         # reset movement variables (delta x/y)
-        screen_scroll = 0
         dx = 0
         dy = 0
         # assign left/right movement variables
@@ -202,66 +524,72 @@ class Character(pygame.sprite.Sprite):
         # increase dy position by jump
         dy += self.y_velocity
 
-        # check for collision
-        for tile in world.obstacle_list:
+        # check for collision against the solid cells this character covers
+        area = self.rect.union(self.rect.move(dx, dy))
+        self.grounded = False
+        for tile in world.cell_rects(world.solid, area):
             # check collision in the x direction
-            if tile[1].colliderect(self.rect.x + dx, self.rect.y, self.width, self.height):
+            if tile.colliderect(self.rect.x + dx, self.rect.y, self.width, self.height):
                 dx = 0
             # check for collision in the y direction
-            if tile[1].colliderect(self.rect.x, self.rect.y + dy, self.width, self.height):
+            if tile.colliderect(self.rect.x, self.rect.y + dy, self.width, self.height):
                 # check if below the ground, i.e. jumping
                 if self.y_velocity < 0:
                     self.y_velocity = 0
-                    dy = tile[1].bottom - self.rect.top
+                    dy = tile.bottom - self.rect.top
                 # check if above the ground, i.e. falling
                 elif self.y_velocity >= 0:
                     self.y_velocity = 0
                     self.in_air = False
-                    dy = tile[1].top - self.rect.bottom
+                    self.grounded = True
+                    dy = tile.top - self.rect.bottom
         # check if going off the edges of the screen
         if self.char_type == 'player':
-            if self.rect.left + dx < 0 or self.rect.right + dx > SCREEN_WIDTH:
+            if self.rect.left + dx < camera.x or self.rect.right + dx > camera.x + SCREEN_WIDTH:
                 dx = 0
         # check for collision with exit
         level_complete = False
-        if pygame.sprite.spritecollide(self, exit_group, False):
-            level_complete = True
+        for exit in world.grid.query('exit', self.rect):
+            if self.rect.colliderect(exit.rect):
+                level_complete = True
         # check if fallen off the map
         if self.rect.bottom > SCREEN_HEIGHT:
             self.hp = 0
         # check for collision with water
-        if pygame.sprite.spritecollide(self, water_group, False):
+        if world.cell_rects(world.water, self.rect):
             self.hp = 0
         # update sprite position
         self.rect.x += dx
         self.rect.y += dy
 
-        # background scrolling based on player movement
+        # camera scrolling based on player movement
         if self.char_type == 'player':
-            if (self.rect.right > SCREEN_WIDTH - SCROLL_THRESHOLD and bg_scroll < (
-                    world.level_length * TILE_SIZE) - SCREEN_WIDTH) \
-                    or (self.rect.left < SCROLL_THRESHOLD and bg_scroll > abs(dx)):
-                self.rect.x -= dx
-                screen_scroll = -dx
-        return screen_scroll, level_complete
+            camera.follow(self.rect, dx, world.level_length * TILE_SIZE)
+        return level_complete
 
     def draw(self):
         """
         Character Drawing on Screen
         """
-        screen.blit(pygame.transform.flip(self.image, self.flip, False), self.rect)
+        # interpolate between the last two simulation ticks
+        rect = self.rect.move(round((self.prev_x - self.rect.x) * (1 - camera.alpha)),
+                              round((self.prev_y - self.rect.y) * (1 - camera.alpha)))
+        if self.flip:
+            camera.blit(self.flipped_image, rect)
+        else:
+            camera.blit(self.image, rect)
 
 
     def update_anime(self):
         '''
         Sprite updater with animation timer
         '''
-        ANIMATION_COOLDOWN = 200
         # update image for frame
         self.image = self.anime_list[self.action][self.frame]
+        self.flipped_image = self.flipped_list[self.action][self.frame]
         # check if time to update
-        if pygame.time.get_ticks() - self.update_time > ANIMATION_COOLDOWN:
-            self.update_time = pygame.time.get_ticks()
+        if sim_ticks - self.update_time > ANIMATION_COOLDOWN:
+            self.update_time = sim_ticks
             self.frame += 1
             # prevents sprite from looping hit/attack animation
             if (self.action == 4 or self.action == 3) and self.frame == len(self.anime_list[self.action]):
@@ -288,80 +616,721 @@ class Character(pygame.sprite.Sprite):
             self.action = new_action
             # update the animation settings
             self.frame = 0
-            self.update_time = pygame.time.get_ticks()
-
-    def ai(self):
-        '''
-        AI for NPC sprites
-        '''
-        if self.alive and player.alive:
-            if self.idling == False and random.randint(1, 200) == 1:
-                self.update_action(0)  # 0: idle
-                self.idling = True
-                self.idling_counter = 50
-            # check if ncp near player
-            if self.vision.colliderect(player.rect):
-                # face player
-                if self.direction != player.direction * -1:
-                    self.direction *= -1
-                # attack player
-                self.char_hit()
-            else:
-                if self.idling == False:
-                    if self.direction == 1:
-                        ai_moving_right = True
-                    else:
-                        ai_moving_right = False
-                    ai_moving_left = not ai_moving_right
-                    self.move(ai_moving_left, ai_moving_right)
-                    self.update_action(1)  # 1: run
-                    self.move_counter += 1
-                    # update ai vision as the enemy moves
-                    self.vision.center = (self.rect.centerx * self.direction, self.rect.centery)
-                    if self.move_counter > TILE_SIZE:
-                        self.direction *= -1
-                        self.move_counter *= -1
-                else:
-                    self.idling_counter -= 1
-                    if self.idling_counter <= 0:
-                        self.idling = False
-
-        #scroll characters
-        self.rect.x += screen_scroll
+            self.update_time = sim_ticks
 
     def char_hit(self):
         '''
-        All sprite hit opportunities
+        Player attack against every enemy it overlaps
         '''
         # stop attacking if player is dead
         if player.alive == False:
             return
-        # enemy attacking logic
-        for enemy in enemy_group:
-            if self == enemy and enemy.attack_cd == 0:
-                if pygame.sprite.collide_rect(enemy, player) and enemy.alive:
-                    if player.hit == False and enemy.attack == False:
-                        enemy.update_action(4)
-                        enemy.attack = True
-                        player.hit = True
-                        enemy.attack_cd = 100
-                        if self.char_type == 'enemy/slime':
-                            player.hp -= 50
-                        else:
-                            player.hp -= 150
-                        enemy.update()
-                enemy.attack = False
-                enemy.hit = False
-                enemy.update()
-            # player attacking logic
-            if self == player:
-                player.attack_cd = 100
-                if pygame.sprite.collide_rect(player, enemy):
-                    if enemy.hit == False and player.attack:
-                        enemy.hit = True
-                        enemy.hp -= 10
-                if player.attack_cd == 0:
-                    player.attack = False
+        if len(world.enemies):
+            player.attack_cd = 100
+        world.enemies.take_hits(self.rect, 10)
+
+    def throw_knife(self):
+        '''
+        Throw a knife the way the character faces, once the throw cooldown is over
+        '''
+        self.throw = False
+        if self.throw_cd > 0:
+            return
+        self.throw_cd = THROW_COOLDOWN
+        # thrown low enough to reach slimes
+        world.effects.spawn(KNIFE, self.rect.centerx + self.direction * self.width // 2,
+                            self.rect.bottom - self.height // 3, KNIFE_SPEED * self.direction, 0)
+
+
+PLAYER_SCALE = SCALE / 1.5
+# enemy kinds by spawn tile -> char_type, scale, speed, hp, damage, spawn x offset
+ENEMY_KINDS = (
+    ('enemy/slime', SCALE/2, 2, 1000, 50, 0),
+    ('enemy/knight', SCALE / 2, 2, 2000, 150, -3),
+    ('enemy/shade', SCALE/3, 2, 2000, 150, -9),
+)
+ENEMY_TILES = {16: 0, 17: 1, 18: 2}
+# projectile and particle kinds -> size, colour, gravity scale, damage, ticks to live
+EFFECT_KINDS = (
+    ((12, 4), WHITE, 0, 250, 60),  # thrown knife
+    ((3, 3), (255, 220, 80), 0.5, 0, 12),  # spark where a projectile stops
+    ((4, 4), RED, 1, 0, 40),  # burst from a dying enemy
+)
+KNIFE = 0
+SPARK = 1
+BURST = 2
+# slots shared by every projectile and particle of a world
+EFFECT_CAPACITY = 4096
+KNIFE_SPEED = 12
+THROW_COOLDOWN = 30
+SPARKS_PER_HIT = 8
+BURST_PARTICLES = 24
+
+def summed_area(cells):
+    '''
+    Summed-area table of a bool grid -> any cell in a rectangle in four lookups
+    '''
+    table = np.zeros((cells.shape[0] + 1, cells.shape[1] + 1), dtype=np.int32)
+    table[1:, 1:] = cells.cumsum(0).cumsum(1)
+    return table
+
+class ActivationZone():
+    '''
+    Awake slice of entities sorted by x -> woken near the view, asleep far from it
+    '''
+    def __init__(self, xs):
+        self.xs = np.asarray(xs)
+        self.lo = 0
+        self.hi = 0
+        # view's left edge at the last update
+        self.left = 0
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    def update(self, left, right):
+        '''
+        Move the slice edges with the view, returns True when the slice changed
+        '''
+        xs = self.xs
+        self.left = left
+        # between the wake and sleep margins an entity keeps its current state
+        lo = min(max(self.lo, xs.searchsorted(left - SLEEP_MARGIN)), xs.searchsorted(left - WAKE_MARGIN))
+        hi = min(max(self.hi, xs.searchsorted(right + WAKE_MARGIN, 'right')),
+                 xs.searchsorted(right + SLEEP_MARGIN, 'right'))
+        changed = (lo, hi) != (self.lo, self.hi)
+        self.lo = lo
+        self.hi = hi
+        return changed
+
+
+class Navigation():
+    '''
+    Walkable platform spans of the loaded columns -> patrol bounds and a flow field toward the player's span
+    '''
+    # distance of a span with no way to the player
+    UNREACHED = 1 << 30
+
+    def __init__(self, solid, water, first_col, clearance):
+        self.first_col = first_col
+        rows, cols = solid.shape
+        open_cells = ~solid & ~water
+        # standing cells -> open with room for the tallest enemy and solid ground under
+        stand = np.zeros((rows, cols), dtype=bool)
+        stand[:-1] = open_cells[:-1] & solid[1:]
+        for k in range(1, min(clearance, rows)):
+            stand[k:] &= open_cells[:-k]
+        # runs of standing cells along a row are the spans, numbered row by row
+        padded = np.zeros((rows, cols + 2), dtype=np.int8)
+        padded[:, 1:-1] = stand
+        edges = np.diff(padded, axis=1)
+        span_rows, firsts = np.nonzero(edges == 1)
+        lasts = np.nonzero(edges == -1)[1] - 1
+        self.count = len(firsts)
+        labels = np.cumsum(edges[:, :-1] == 1).reshape(rows, cols) - 1
+        self.span_at = np.where(stand, labels, -1)
+        # span a fall from each cell lands on, -1 into water, a wall or out of the level
+        below = np.full((rows + 1, cols), -1, dtype=np.int64)
+        for row in range(rows - 1, -1, -1):
+            below[row] = np.where(stand[row], self.span_at[row], np.where(open_cells[row], below[row + 1], -1))
+        # every per-span array has a trailing entry for span -1 -> lookups need no masking
+        self.first = np.append(firsts, 0)
+        self.last = np.append(lasts, 0)
+        self.drop_left = np.append(np.where(firsts > 0, below[span_rows, np.maximum(firsts - 1, 0)], -1), -1)
+        self.drop_right = np.append(np.where(lasts < cols - 1, below[span_rows, np.minimum(lasts + 1, cols - 1)], -1), -1)
+        self.target = -1
+        self.dist = np.full(self.count + 1, self.UNREACHED, dtype=np.int64)
+        self.flow = np.zeros(self.count + 1, dtype=np.int64)
+
+    def span_of(self, left, right, bottom):
+        '''
+        Span each rect stands on, -1 in the air or off the spans
+        '''
+        rows, cols = self.span_at.shape
+        row = bottom // TILE_SIZE - 1
+        found = np.full(len(row), -1, dtype=np.int64)
+        standing = (bottom % TILE_SIZE == 0) & (row >= 0) & (row < rows)
+        # the cell under the centre, else under either edge of a rect hanging over a ledge
+        for x in ((left + right) // 2, left, right - 1):
+            col = x // TILE_SIZE - self.first_col
+            inside = standing & (found < 0) & (col >= 0) & (col < cols)
+            found[inside] = self.span_at[row[inside], col[inside]]
+        return found
+
+    def track(self, rect):
+        '''
+        Point the flow field at the player's span, only redone when they land on another one
+        '''
+        rows, cols = self.span_at.shape
+        row = rect.bottom // TILE_SIZE - 1
+        if rect.bottom % TILE_SIZE or not 0 <= row < rows:
+            return
+        span = -1
+        for x in ((rect.left + rect.right) // 2, rect.left, rect.right - 1):
+            col = x // TILE_SIZE - self.first_col
+            if span < 0 and 0 <= col < cols:
+                span = int(self.span_at[row, col])
+        if span < 0 or span == self.target:
+            return
+        self.target = span
+        dist = np.full(self.count + 1, self.UNREACHED, dtype=np.int64)
+        dist[span] = 0
+        # walking off a ledge is the only way between spans
+        while True:
+            via_left = np.where(self.drop_left >= 0, dist[self.drop_left] + 1, self.UNREACHED)
+            via_right = np.where(self.drop_right >= 0, dist[self.drop_right] + 1, self.UNREACHED)
+            nearest = np.minimum(dist, np.minimum(via_left, via_right))
+            nearest[-1] = self.UNREACHED
+            if (nearest == dist).all():
+                break
+            dist = nearest
+        self.dist = dist
+        self.flow = np.where(via_left < via_right, -1, 1)
+        self.flow[(dist >= self.UNREACHED) | (np.arange(self.count + 1) == span)] = 0
+
+
+class EnemyManager():
+    '''
+    Structure-of-arrays enemy simulation -> every enemy advanced in one batch per tick
+    '''
+    def __init__(self, seed=None, effects=None):
+        self.spawns = []
+        self.rng = np.random.default_rng(seed)
+        # projectiles and particles of the same world
+        self.effects = effects if effects is not None else EffectPool(EFFECT_CAPACITY)
+        # per kind animation frames and frame counts, shared with load_animations
+        self.frames = []
+        self.flipped = []
+        # the same frames sized for drawing
+        self.render_frames = []
+        self.render_flipped = []
+        for char_type, scale, speed, hp, damage, offset in ENEMY_KINDS:
+            anime_list, flipped_list = load_animations(char_type, scale)
+            self.frames.append(anime_list)
+            self.flipped.append(flipped_list)
+            self.render_frames.append([[render_image(img) for img in frames] for frames in anime_list])
+            self.render_flipped.append([[render_image(img) for img in frames] for frames in flipped_list])
+        self.frame_counts = np.array([[len(frames) for frames in anime_list] for anime_list in self.frames])
+        self.speeds = np.array([kind[2] for kind in ENEMY_KINDS])
+        self.damages = np.array([kind[4] for kind in ENEMY_KINDS])
+        # widest enemy decides how many cells a rect can span
+        self.span = max(max(frames[0][0].get_size()) for frames in self.frames) // TILE_SIZE + 2
+        # rows of headroom a platform needs for the tallest enemy
+        self.clearance = -(-max(frames[0][0].get_height() for frames in self.frames) // TILE_SIZE)
+        # furthest an enemy strays from its spawn x -> waking, sleeping and releasing go by spawn position, so an
+        # enemy in view is always awake, its chunk is never released on screen and its cells are always loaded
+        self.leash = WAKE_MARGIN - max(frames[0][0].get_width() for frames in self.frames) - TILE_SIZE
+        # collision cells of the loaded columns, starting at first_col
+        self.set_cells(np.zeros((0, 0), dtype=bool), np.zeros((0, 0), dtype=bool), 0)
+        self.count = 0
+        self.zone = ActivationZone(np.zeros(0, dtype=np.int64))
+        self.columns = self.new_columns(np.zeros((0, 8), dtype=np.int64))
+        self.wake()
+
+    def __len__(self):
+        return self.count
+
+    def spawn(self, tile, x, y, origin):
+        '''
+        Queue an enemy for a spawn tile, placed the way a Character centres its rect
+        '''
+        kind = ENEMY_TILES[tile]
+        char_type, scale, speed, hp, damage, offset = ENEMY_KINDS[kind]
+        rect = self.frames[kind][0][0].get_rect()
+        rect.center = (x * TILE_SIZE + offset, y * TILE_SIZE / 2)
+        self.spawns.append((kind, rect.x, rect.y, rect.width, rect.height, hp, x, origin))
+
+    def set_cells(self, solid, water, first_col):
+        '''
+        Collision grids of the loaded columns, solid and water are per-cell bool grids
+        '''
+        self.solid = summed_area(solid)
+        self.water = summed_area(water)
+        self.first_col = first_col
+        self.nav = Navigation(solid, water, first_col, self.clearance)
+
+    def new_columns(self, spawns):
+        '''
+        Per-enemy arrays for rows of queued spawns
+        '''
+        n = len(spawns)
+        kind = spawns[:, 0]
+        return {
+            'kind': kind,
+            'x': spawns[:, 1].copy(),
+            'y': spawns[:, 2].copy(),
+            'w': spawns[:, 3].copy(),
+            'h': spawns[:, 4].copy(),
+            'hp': spawns[:, 5].copy(),
+            # spawn column and x, and the spawn's id in the level
+            'home_col': spawns[:, 6].copy(),
+            'home_x': spawns[:, 1].copy(),
+            'origin': spawns[:, 7].copy(),
+            'prev_x': spawns[:, 1].copy(),
+            'prev_y': spawns[:, 2].copy(),
+            'y_velocity': np.zeros(n),
+            'direction': np.ones(n, dtype=np.int64),
+            'flip': np.zeros(n, dtype=bool),
+            'mirrored': kind == 0,  # slime sprites are mirrored from others
+            'alive': np.ones(n, dtype=bool),
+            'hit': np.zeros(n, dtype=bool),
+            'attack_cd': np.zeros(n, dtype=np.int64),
+            'idling': np.zeros(n, dtype=bool),
+            'idling_counter': np.zeros(n, dtype=np.int64),
+            # 20x20 vision rect centres
+            'vision_x': np.full(n, 10, dtype=np.int64),
+            'vision_y': np.full(n, 10, dtype=np.int64),
+            'action': np.zeros(n, dtype=np.int64),
+            'frame': np.zeros(n, dtype=np.int64),
+            'update_time': np.full(n, sim_ticks, dtype=np.int64),
+        }
+
+    def merge(self):
+        '''
+        Add the queued spawns to the arrays
+        '''
+        if not self.spawns:
+            return
+        new = self.new_columns(np.array(self.spawns, dtype=np.int64))
+        self.spawns = []
+        self.regroup({name: np.concatenate((column, new[name])) for name, column in self.columns.items()})
+
+    def release(self, first_col, last_col):
+        '''
+        Drop the enemies spawned in a column range, returns the ids of the dead ones
+        '''
+        gone = (self.columns['home_col'] >= first_col) & (self.columns['home_col'] < last_col)
+        if not gone.any():
+            return []
+        dead = self.columns['origin'][gone & ~self.columns['alive']].tolist()
+        self.regroup({name: column[~gone] for name, column in self.columns.items()})
+        return dead
+
+    def regroup(self, columns):
+        '''
+        Sort new arrays by home x, enemies that were awake stay awake
+        '''
+        awake = self.columns['origin'][self.zone.lo:self.zone.hi]
+        order = np.argsort(columns['home_x'], kind='stable')
+        self.columns = {name: column[order] for name, column in columns.items()}
+        self.count = len(order)
+        self.zone.xs = self.columns['home_x']
+        still = np.flatnonzero(np.isin(self.columns['origin'], awake))
+        if len(still):
+            self.zone.lo = still[0]
+            self.zone.hi = still[-1] + 1
+        else:
+            self.zone.lo = self.zone.hi = self.zone.xs.searchsorted(self.zone.left - WAKE_MARGIN)
+        self.wake()
+
+    def wake(self):
+        '''
+        Point every per-enemy attribute at the awake slice, sleeping enemies keep their state
+        '''
+        awake = slice(self.zone.lo, self.zone.hi)
+        for name, column in self.columns.items():
+            setattr(self, name, column[awake])
+
+    def activate(self, left, right):
+        if self.zone.update(left, right):
+            self.wake()
+
+    def restart_clock(self):
+        '''
+        Animation timers start now, for enemies built ahead of time on another thread
+        '''
+        self.columns['update_time'][:] = sim_ticks
+
+    def snapshot(self):
+        '''
+        Copy of every enemy's state, the random stream and the awake slice
+        '''
+        return {
+            'columns': {name: column.copy() for name, column in self.columns.items()},
+            'zone': (self.zone.lo, self.zone.hi, self.zone.left),
+            'rng': self.rng.bit_generator.state,
+        }
+
+    def restore(self, state, elapsed):
+        '''
+        Put back a snapshot taken elapsed ticks ago, queued spawns are dropped
+        '''
+        self.spawns = []
+        self.columns = {name: column.copy() for name, column in state['columns'].items()}
+        self.columns['update_time'] += elapsed
+        self.count = len(self.columns['kind'])
+        self.zone.xs = self.columns['home_x']
+        self.zone.lo, self.zone.hi, self.zone.left = state['zone']
+        self.rng.bit_generator.state = state['rng']
+        self.wake()
+
+    def store_previous(self):
+        self.prev_x[:] = self.x
+        self.prev_y[:] = self.y
+
+    def update_action(self, mask, new_action):
+        changed = mask & (self.action != new_action)
+        self.action[changed] = new_action
+        self.frame[changed] = 0
+        self.update_time[changed] = sim_ticks
+
+    def overlaps(self, rect, x, y, w, h):
+        return (x < rect.right) & (x + w > rect.left) & (y < rect.bottom) & (y + h > rect.top)
+
+    def cell_span(self, cells, idx, left, top):
+        '''
+        Cell rows/cols each rect covers, clipped to the loaded columns
+        '''
+        rows = cells.shape[0] - 1
+        cols = cells.shape[1] - 1
+        col0 = np.maximum(left // TILE_SIZE - self.first_col, 0)
+        col1 = np.minimum((left + self.w[idx] - 1) // TILE_SIZE - self.first_col, cols - 1)
+        row0 = np.maximum(top // TILE_SIZE, 0)
+        row1 = np.minimum((top + self.h[idx] - 1) // TILE_SIZE, rows - 1)
+        return row0, row1, col0, col1
+
+    def any_cell(self, cells, idx, left, top):
+        '''
+        Whether each rect overlaps a set cell, cells is a summed-area table
+        '''
+        row0, row1, col0, col1 = self.cell_span(cells, idx, left, top)
+        inside = (row0 <= row1) & (col0 <= col1)
+        row0 = np.minimum(row0, row1 + 1)
+        col0 = np.minimum(col0, col1 + 1)
+        total = cells[row1 + 1, col1 + 1] - cells[row0, col1 + 1] - cells[row1 + 1, col0] + cells[row0, col0]
+        return inside & (total > 0)
+
+    def lowest_cell(self, cells, idx, left, top):
+        '''
+        Lowest row of a set cell each rect overlaps, -1 when it overlaps none
+        '''
+        row0, row1, col0, col1 = self.cell_span(cells, idx, left, top)
+        found = np.full(len(idx), -1, dtype=np.int64)
+        inside = col0 <= col1
+        col0 = np.minimum(col0, col1 + 1)
+        for dr in range(self.span):
+            row = row0 + dr
+            ok = inside & (row <= row1)
+            row = np.minimum(row, cells.shape[0] - 2)
+            count = cells[row + 1, col1 + 1] - cells[row, col1 + 1] - cells[row + 1, col0] + cells[row, col0]
+            found[ok & (count > 0)] = row[ok & (count > 0)]
+        return found
+
+    def ai(self, player):
+        '''
+        Idle, vision, attack and patrol decisions for every awake enemy at once
+        '''
+        live = self.alive & player.alive
+        if quality.level >= THROTTLE_AI and sim_ticks % AI_STRIDE:
+            # off screen enemies sit this tick out
+            live &= (self.x + self.w > camera.x) & (self.x < camera.x + camera.width)
+        # randomly stop and idle
+        start_idle = live & ~self.idling & (self.rng.integers(1, 201, len(self.x)) == 1)
+        self.update_action(start_idle, 0)  # 0: idle
+        self.idling |= start_idle
+        self.idling_counter[start_idle] = 50
+        # check if ncp near player
+        sees = live & self.overlaps(player.rect, self.vision_x - 10, self.vision_y - 10, 20, 20)
+        # face player
+        self.direction[sees & (self.direction != -player.direction)] *= -1
+        # attack player, the first enemy in reach wins the tick
+        ready = sees & (self.attack_cd == 0)
+        reach = ready & self.overlaps(player.rect, self.x, self.y, self.w, self.h)
+        attackers = np.flatnonzero(reach)
+        if len(attackers) and player.hit == False:
+            i = attackers[0]
+            self.update_action(np.arange(len(self.x)) == i, 4)
+            player.hit = True
+            player.hp -= self.damages[self.kind[i]]
+            # cooldown also ticks in the two updates that follow an attack
+            self.attack_cd[i] = 98
+        self.hit[ready] = False
+        # patrol, or chase a player in range along the flow field
+        self.nav.track(player.rect)
+        centre = self.x + self.w // 2
+        span = self.nav.span_of(self.x, self.x + self.w, self.y + self.h)
+        active = live & ~sees & ~self.idling
+        chasing = active & (self.nav.dist[span] < Navigation.UNREACHED) \
+            & (np.abs(player.rect.centerx - centre) < CHASE_RANGE)
+        # on the player's span head straight for them, elsewhere for the ledge the flow field points over
+        heading = np.where(span == self.nav.target, np.sign(player.rect.centerx - centre), self.nav.flow[span])
+        self.direction[chasing & (heading != 0)] = heading[chasing & (heading != 0)]
+        # a chaser already under the player, or at the end of its leash, waits for it
+        leashed = np.abs(centre + heading * self.speeds[self.kind] - (self.home_x + self.w // 2)) > self.leash
+        waiting = chasing & ((heading == 0) | leashed)
+        self.update_action(waiting, 0)  # 0: idle
+        moving = active & ~waiting
+        walkers = np.flatnonzero(moving)
+        self.move(walkers, span, chasing)
+        self.update_action(moving, 1)  # 1: run
+        # update ai vision as the enemy moves
+        self.vision_x[walkers] = (self.x[walkers] + self.w[walkers] // 2) * self.direction[walkers]
+        self.vision_y[walkers] = self.y[walkers] + self.h[walkers] // 2
+        # count down idling
+        resting = live & ~sees & self.idling
+        self.idling_counter[resting] -= 1
+        self.idling[resting & (self.idling_counter <= 0)] = False
+
+    def move(self, idx, span, chasing):
+        '''
+        Walk the given enemies along their spans, patrollers turn at the ends
+        Enemies off the spans fall and collide against the level grids
+        '''
+        if not len(idx):
+            return
+        direction = self.direction[idx]
+        dx = self.speeds[self.kind[idx]] * direction
+        self.flip[idx] = np.where(direction == 1, self.mirrored[idx], ~self.mirrored[idx])
+        nav = self.nav
+        span = span[idx]
+        # spans narrower than the enemy are left to the collision pass
+        grounded = (span >= 0) & ((nav.last[span] - nav.first[span] + 1) * TILE_SIZE >= self.w[idx])
+        walk = idx[grounded]
+        span = span[grounded]
+        x = self.x[walk]
+        new_x = x + dx[grounded]
+        # a span is walked by lookup within the leash, an enemy hanging over either end never goes further out
+        home_x = self.home_x[walk]
+        lo = np.minimum(np.maximum((nav.first[span] + nav.first_col) * TILE_SIZE, home_x - self.leash), x)
+        hi = np.maximum(np.minimum((nav.last[span] + 1 + nav.first_col) * TILE_SIZE - self.w[walk],
+                                   home_x + self.leash), x)
+        stop_x = np.minimum(np.maximum(new_x, lo), hi)
+        # chasers walk off the ledge the flow field points over, then fall below
+        drop = chasing[walk] & (np.where(direction[grounded] < 0, nav.drop_left[span], nav.drop_right[span]) >= 0)
+        stop_x[drop] = new_x[drop]
+        turn = walk[(stop_x != new_x) & ~chasing[walk]]
+        self.direction[turn] *= -1
+        self.x[walk] = stop_x
+        idx = idx[~grounded]
+        if not len(idx):
+            return
+        dx = dx[~grounded]
+        # gravity
+        velocity = np.minimum(self.y_velocity[idx] + GRAVITY, 10)
+        dy = velocity.copy()
+        x = self.x[idx]
+        y = self.y[idx]
+        # walls and the leash stop horizontal movement and turn patrollers around
+        home_x = self.home_x[idx]
+        walled = self.any_cell(self.solid, idx, x + dx, y) \
+            | (np.abs(x + dx - home_x) > np.maximum(np.abs(x - home_x), self.leash))
+        dx[walled] = 0
+        self.direction[idx[walled & ~chasing[idx]]] *= -1
+        # landing on the ground, enemies never jump so only falling is checked
+        ground = self.lowest_cell(self.solid, idx, x, np.trunc(y + dy).astype(np.int64))
+        landed = ground >= 0
+        velocity[landed] = 0
+        dy[landed] = ground[landed] * TILE_SIZE - (y[landed] + self.h[idx][landed])
+        self.y_velocity[idx] = velocity
+        # fallen off the map or into water
+        dead = (y + self.h[idx] > SCREEN_HEIGHT) | self.any_cell(self.water, idx, x, y)
+        self.hp[idx[dead]] = 0
+        self.x[idx] = x + dx
+        self.y[idx] = np.floor(y + dy + 0.5).astype(np.int64)
+
+    def update(self):
+        '''
+        Death checks, animation timers and cooldowns
+        '''
+        dead = self.alive & (self.hp <= 0)
+        self.hp[self.hp < 0] = 0
+        self.alive &= ~dead
+        if dead.any():
+            # particles fly out of every enemy that died this tick
+            self.effects.burst(BURST, (self.x + self.w // 2)[dead], (self.y + self.h // 2)[dead], BURST_PARTICLES, 5)
+        self.update_action(~self.alive, 2)
+        if animation_due():
+            due = sim_ticks - self.update_time > ANIMATION_COOLDOWN
+            self.update_time[due] = sim_ticks
+            self.frame[due] += 1
+            counts = self.frame_counts[self.kind, self.action]
+            # hit/attack animations play once then return to idle
+            finished = due & ((self.action == 4) | (self.action == 3)) & (self.frame == counts)
+            self.action[finished] = 0
+            self.frame[finished] = 0
+            self.hit[finished] = False
+            # loop animation, death holds its last frame
+            over = ~finished & (self.frame >= counts)
+            self.frame[over & (self.action == 2)] = counts[over & (self.action == 2)] - 1
+            self.frame[over & (self.action != 2)] = 0
+        self.attack_cd[self.attack_cd > 0] -= 1
+        # react to being hit
+        reacting = self.alive & self.hit
+        self.update_action(reacting, 3)
+        self.hit[reacting] = False
+
+    def take_hits(self, rect, damage):
+        '''
+        Damage every enemy overlapping rect that was not already hit this tick
+        '''
+        struck = ~self.hit & self.overlaps(rect, self.x, self.y, self.w, self.h)
+        self.hit |= struck
+        self.hp[struck] -= damage
+        return struck.any()
+
+    def take_shots(self, x, y, w, h, damage):
+        '''
+        Batched rect hits -> each shot lands on the first live enemy it overlaps, returns which shots landed
+        '''
+        if not len(self.x):
+            return np.zeros(len(x), dtype=bool)
+        overlap = (x[:, None] < self.x + self.w) & (x[:, None] + w[:, None] > self.x) \
+            & (y[:, None] < self.y + self.h) & (y[:, None] + h[:, None] > self.y) & self.alive
+        landed = overlap.any(1)
+        target = overlap.argmax(1)[landed]
+        # several shots can land on one enemy in the same tick
+        np.subtract.at(self.hp, target, damage[landed])
+        self.hit[target] = True
+        return landed
+
+    def draw(self):
+        '''
+        Blit every enemy in view in a single batched call
+        '''
+        keep = 1 - camera.alpha
+        x = np.rint(self.x + (self.prev_x - self.x) * keep).astype(np.int64)
+        y = np.rint(self.y + (self.prev_y - self.y) * keep).astype(np.int64)
+        visible = np.flatnonzero((x + self.w > camera.offset) & (x < camera.offset + camera.width))
+        left = np.rint((x[visible] - camera.offset) * RENDER_SCALE).astype(np.int64)
+        top = np.rint(y[visible] * RENDER_SCALE).astype(np.int64)
+        blits = []
+        for kind, action, frame, flip, sx, sy in zip(self.kind[visible], self.action[visible], self.frame[visible],
+                                                     self.flip[visible], left.tolist(), top.tolist()):
+            frames = self.render_flipped[kind] if flip else self.render_frames[kind]
+            blits.append((frames[action][frame], (sx, sy)))
+        screen.blits(blits, False)
+        camera.blits += len(blits)
+
+
+class EffectPool():
+    '''
+    Projectiles and particles in preallocated structure-of-arrays slots -> spawning reuses free slots, nothing is allocated mid-level
+    '''
+    def __init__(self, capacity, seed=None):
+        self.capacity = capacity
+        # effects draw from their own stream -> they never shift the enemies' random draws
+        self.rng = np.random.default_rng(seed)
+        # centre position, velocity, and position at the start of the tick
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.vx = np.zeros(capacity)
+        self.vy = np.zeros(capacity)
+        self.prev_x = np.zeros(capacity)
+        self.prev_y = np.zeros(capacity)
+        self.life = np.zeros(capacity, dtype=np.int64)
+        self.kind = np.zeros(capacity, dtype=np.int64)
+        self.active = np.zeros(capacity, dtype=bool)
+        # stack of free slots, the first free_count entries
+        self.free = np.arange(capacity)
+        self.free_count = capacity
+        self.widths = np.array([kind[0][0] for kind in EFFECT_KINDS])
+        self.heights = np.array([kind[0][1] for kind in EFFECT_KINDS])
+        self.gravity = np.array([kind[2] for kind in EFFECT_KINDS])
+        self.damages = np.array([kind[3] for kind in EFFECT_KINDS])
+        self.lifetimes = np.array([kind[4] for kind in EFFECT_KINDS])
+
+    def __len__(self):
+        return self.capacity - self.free_count
+
+    def spawn(self, kind, x, y, vx, vy):
+        '''
+        Take free slots for a batch of one kind, scalars are shared by the batch
+        Whatever does not fit in the pool is dropped
+        '''
+        count = np.broadcast(x, y, vx, vy).size
+        n = min(count, self.free_count)
+        if not n:
+            return
+        self.free_count -= n
+        slots = self.free[self.free_count:self.free_count + n]
+        for values, column in ((x, self.x), (y, self.y), (vx, self.vx), (vy, self.vy)):
+            column[slots] = np.broadcast_to(values, (count,))[:n]
+        self.prev_x[slots] = self.x[slots]
+        self.prev_y[slots] = self.y[slots]
+        self.life[slots] = self.lifetimes[kind]
+        self.kind[slots] = kind
+        self.active[slots] = True
+
+    def burst(self, kind, x, y, count, speed):
+        '''
+        count particles from every point, flying out and up at random
+        '''
+        x = np.repeat(x, count)
+        y = np.repeat(y, count)
+        angle = self.rng.uniform(np.pi, 2 * np.pi, len(x))
+        power = self.rng.uniform(0.3, 1, len(x)) * speed
+        self.spawn(kind, x, y, np.cos(angle) * power, np.sin(angle) * power)
+
+    def release(self, slots):
+        self.active[slots] = False
+        self.free[self.free_count:self.free_count + len(slots)] = slots
+        self.free_count += len(slots)
+
+    def clear(self):
+        self.active[:] = False
+        self.free[:] = np.arange(self.capacity)
+        self.free_count = self.capacity
+
+    def update(self, solid, first_col, enemies):
+        '''
+        Move every effect one tick, then expire those out of time, in a solid cell or off the loaded columns
+        Projectiles stop in the first enemy they hit and throw sparks
+        '''
+        idx = np.flatnonzero(self.active)
+        if not len(idx):
+            return
+        self.prev_x[idx] = self.x[idx]
+        self.prev_y[idx] = self.y[idx]
+        kind = self.kind[idx]
+        self.vy[idx] += GRAVITY * self.gravity[kind]
+        self.x[idx] += self.vx[idx]
+        self.y[idx] += self.vy[idx]
+        self.life[idx] -= 1
+        x = self.x[idx]
+        y = self.y[idx]
+        # the cell under each centre, anything above the level flies on
+        rows, cols = solid.shape
+        row = (y // TILE_SIZE).astype(np.int64)
+        col = (x // TILE_SIZE).astype(np.int64) - first_col
+        loaded = (col >= 0) & (col < cols) & (row < rows)
+        inside = loaded & (row >= 0)
+        blocked = np.zeros(len(idx), dtype=bool)
+        blocked[inside] = solid[row[inside], col[inside]]
+        damage = self.damages[kind]
+        armed = np.flatnonzero((damage > 0) & loaded & ~blocked)
+        landed = np.zeros(len(idx), dtype=bool)
+        if len(armed):
+            w = self.widths[kind[armed]]
+            h = self.heights[kind[armed]]
+            landed[armed] = enemies.take_shots(x[armed] - w // 2, y[armed] - h // 2, w, h, damage[armed])
+        stopped = (landed | blocked) & (damage > 0)
+        self.release(idx[landed | blocked | ~loaded | (self.life[idx] <= 0)])
+        if stopped.any():
+            self.burst(SPARK, x[stopped], y[stopped], SPARKS_PER_HIT, 3)
+
+    def draw(self):
+        '''
+        Blit every effect in view in a single batched call
+        '''
+        idx = np.flatnonzero(self.active)
+        kind = self.kind[idx]
+        keep = 1 - camera.alpha
+        left = np.rint(self.x[idx] + (self.prev_x[idx] - self.x[idx]) * keep - self.widths[kind] // 2).astype(np.int64)
+        top = np.rint(self.y[idx] + (self.prev_y[idx] - self.y[idx]) * keep - self.heights[kind] // 2).astype(np.int64)
+        left -= camera.offset
+        visible = (left + self.widths[kind] > 0) & (left < camera.width)
+        left = np.rint(left[visible] * RENDER_SCALE).astype(np.int64)
+        top = np.rint(top[visible] * RENDER_SCALE).astype(np.int64)
+        blits = []
+        for i, k, x, y in zip(idx[visible].tolist(), kind[visible].tolist(), left.tolist(), top.tolist()):
+            item = effect_blits[i]
+            item[0] = effect_images[k]
+            pos = item[1]
+            pos[0] = x
+            pos[1] = y
+            blits.append(item)
+        screen.blits(blits, False)
+        camera.blits += len(blits)
 
 
 class HealthBar():
@@ -373,69 +1342,428 @@ class HealthBar():
         self.y = y
         self.hp = hp
         self.max_hp = max_hp
+        # bar is rendered once per hp change and blitted from here, in frame pixels
+        self.image = pygame.Surface((px(154), px(24)))
+        self.rect = self.image.get_rect(topleft=(px(x - 2), px(y - 2)))
+        self.render()
 
-    def draw(self, hp):
-        #update with new health
-        self.hp = hp
+    def render(self):
         #calculate health ratio
         ratio = self.hp / self.max_hp
-        pygame.draw.rect(screen, BLACK, (self.x - 2, self.y - 2, 154, 24))
-        pygame.draw.rect(screen, RED, (self.x, self.y, 150, 20))
-        pygame.draw.rect(screen, GREEN, (self.x, self.y, 150 * ratio, 20))
+        self.image.fill(BLACK)
+        pygame.draw.rect(self.image, RED, (px(2), px(2), px(150), px(20)))
+        pygame.draw.rect(self.image, GREEN, (px(2), px(2), px(150 * ratio), px(20)))
+
+    def draw(self, hp):
+        #update with new health
+        if hp != self.hp:
+            self.hp = hp
+            self.render()
+            renderer.mark(self.rect)
+        screen.blit(self.image, self.rect)
+
+
+class TileGrid():
+    '''
+    Uniform grid spatial index -> exit sprites bucketed by column/row in world space
+    Terrain lives in the chunk cell arrays, exits are the only sprites looked up by position
+    '''
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.layers = {}
+
+    def insert(self, layer, rect, item):
+        '''
+        Register an item in every cell its rect covers
+        '''
+        cells = self.layers.setdefault(layer, {})
+        left = rect.left // self.cell_size
+        right = (rect.right - 1) // self.cell_size
+        top = rect.top // self.cell_size
+        bottom = (rect.bottom - 1) // self.cell_size
+        for row in range(top, bottom + 1):
+            for col in range(left, right + 1):
+                cells.setdefault((col, row), []).append(item)
+
+    def query(self, layer, rect):
+        '''
+        Items registered in the cells a rect covers
+        '''
+        cells = self.layers.get(layer)
+        if not cells:
+            return []
+        left = rect.left // self.cell_size
+        right = (rect.right - 1) // self.cell_size
+        top = rect.top // self.cell_size
+        bottom = (rect.bottom - 1) // self.cell_size
+        # an item covering several cells is found once, in insertion order
+        found = {}
+        for row in range(top, bottom + 1):
+            for col in range(left, right + 1):
+                found.update(dict.fromkeys(cells.get((col, row), ())))
+        return list(found)
+
+    def remove(self, layer, rect):
+        '''
+        Forget every cell a rect covers
+        '''
+        cells = self.layers.get(layer)
+        if not cells:
+            return
+        for row in range(rect.top // self.cell_size, (rect.bottom - 1) // self.cell_size + 1):
+            for col in range(rect.left // self.cell_size, (rect.right - 1) // self.cell_size + 1):
+                cells.pop((col, row), None)
+
+
+class LevelChunk():
+    '''
+    Loaded strip of CHUNK_COLS columns -> baked tiles, per-cell tile ids and type layers, and the sprites it spawned
+    '''
+    __slots__ = ('index', 'surface', 'tiles', 'solid', 'water', 'decoration', 'sprites', 'item_boxes')
+
+    def __init__(self, index):
+        self.index = index
+        self.surface = None
+        # rows x CHUNK_COLS tile ids, -1 is empty
+        self.tiles = None
+        # bool layers over the same cells
+        self.solid = None
+        self.water = None
+        self.decoration = None
+        self.sprites = []
+        # (spawn id, item box) -> picked up boxes are remembered on release
+        self.item_boxes = []
 
 
 class World():
     '''
     Overworld Creation imported from CSV's -> tiles dictated by CSV value
+    Streamed in chunks of columns, only the chunks around the camera are loaded
     '''
-    def __init__(self):
-        self.obstacle_list = []
-
-    def process_data(self, data):
-        self.level_length = len(data[0])
-        # iterate through each value in level data file
-        for y, row in enumerate(data):
-            for x, tile in enumerate(row):
-                if tile >= 0:
-                    img = img_list[tile]
-                    img_rect = img.get_rect()
-                    img_rect.x = x * TILE_SIZE
-                    img_rect.y = y * TILE_SIZE
-                    tile_data = (img, img_rect)
-                    # dirt blocks -> add to obstacle list
-                    if tile >= 0 and tile <= 8:
-                        self.obstacle_list.append(tile_data)
-                    elif tile >= 9 and tile <= 10:
-                        water = Water(img, x * TILE_SIZE, y * TILE_SIZE)
-                        water_group.add(water)
-                    elif tile >= 11 and tile <= 14:
-                        decoration = Decoration(img, x * TILE_SIZE, y * TILE_SIZE)
-                        decoration_group.add(decoration)
-                    elif tile == 15:  # create player
-                        player = Character('player', x * TILE_SIZE, y * TILE_SIZE, SCALE/1.5, 5, 2000)
-                        health_bar = HealthBar(10, 10, player.max_hp, player.hp)
-                    elif tile == 16:  # create enemies
-                        enemy = Character('enemy/slime', x * TILE_SIZE, y * TILE_SIZE/2, SCALE/2, 2, 1000)
-                        enemy_group.add(enemy)
-                    elif tile == 17:  # create enemy Knight
-                        enemy = Character('enemy/knight', x * TILE_SIZE - 3, y * TILE_SIZE / 2, SCALE / 2, 2, 2000)
-                        enemy_group.add(enemy)
-                    elif tile == 18:  # create another tile
-                        enemy = Character('enemy/shade', x * TILE_SIZE - 9, y * TILE_SIZE / 2, SCALE/3, 2, 2000)
-                        enemy_group.add(enemy)
-                    elif tile == 19:  # create health box
-                        item_box = ItemBox('Health', x * TILE_SIZE, y * TILE_SIZE)
-                        item_box_group.add(item_box)
-                    elif tile == 20:  # create exit
-                        exit = Exit(img, x * TILE_SIZE, y * TILE_SIZE)
-                        exit_group.add(exit)
-
-        return player, health_bar
+    def __init__(self, data, seed=None):
+        self.data = data
+        self.level_length = data.cols
+        # exits are the only sprites looked up by position, tiles are cells of the loaded chunks
+        self.grid = TileGrid(TILE_SIZE)
+        # loaded chunks by index
+        self.chunks = {}
+        # sprite groups belong to the world -> a level can be built off the main thread
+        # effects are seeded with a child of the world's seed -> a stream apart from the enemies'
+        self.effects = EffectPool(EFFECT_CAPACITY, np.random.SeedSequence(seed).spawn(1)[0])
+        self.enemies = EnemyManager(seed, self.effects)
+        self.item_box_group = pygame.sprite.Group()
+        self.exit_group = pygame.sprite.Group()
+        # solid and water cells of the loaded columns, starting at first_col
+        self.solid = np.zeros((data.rows, 0), dtype=bool)
+        self.water = np.zeros((data.rows, 0), dtype=bool)
+        self.first_col = 0
+        self.zones = {}
+        self.player = None
+        self.health_bar = None
+        # spawns gone for good -> killed enemies and picked up boxes stay gone when reloaded
+        self.removed = set()
+        self.spawning = True
+        # snapshots respawns restore, the level's start and its last checkpoint
+        self.start = None
+        self.saved = None
+        self.next_checkpoint = 0
+
+    def stream(self, left, right):
+        '''
+        Load the chunks the view approaches and release those far from it
+        '''
+        chunk_width = CHUNK_COLS * TILE_SIZE
+        left = int(left)
+        right = int(right)
+        first = max(0, (left - STREAM_MARGIN) // chunk_width)
+        last = min(self.data.chunk_count - 1, (right + STREAM_MARGIN) // chunk_width)
+        keep_first = (left - RELEASE_MARGIN) // chunk_width
+        keep_last = (right + RELEASE_MARGIN) // chunk_width
+        released = [i for i in self.chunks if i < keep_first or i > keep_last]
+        loading = [i for i in range(first, last + 1) if i not in self.chunks]
+        if not released and not loading:
+            return
+        for i in released:
+            self.release_chunk(i)
+        for i in loading:
+            self.load_chunk(i)
+        self.enemies.merge()
+        self.build_cells()
+        self.build_zones()
+
+    def load_chunk(self, i):
+        '''
+        Instantiate one chunk's tiles and entities
+        '''
+        chunk = LevelChunk(i)
+        rows = self.data.rows
+        cells = np.frombuffer(self.data.chunk_tiles(i), dtype=np.int8).reshape(rows, CHUNK_COLS)
+        chunk.tiles = cells
+        # dirt blocks -> solid for collisions, water and decorations are drawn over the characters
+        chunk.solid = (cells >= 0) & (cells <= 8)
+        chunk.water = (cells >= 9) & (cells <= 10) & self.spawning
+        decoration = (cells >= 11) & (cells <= 14)
+        chunk.decoration = decoration & (not BAKE_TILES and self.spawning)
+        if BAKE_TILES:
+            # one transparent surface per chunk, terrain and decorations never change
+            size = (px(CHUNK_COLS * TILE_SIZE), px(rows * TILE_SIZE))
+            chunk.surface = pygame.Surface(size, pygame.SRCALPHA).convert_alpha()
+            ys, xs = np.nonzero(chunk.solid | decoration)
+            chunk.surface.blits([(render_image(img_list[tile]), (px(x * TILE_SIZE), px(y * TILE_SIZE)))
+                                 for tile, x, y in zip(cells[ys, xs].tolist(), xs.tolist(), ys.tolist())], False)
+        if self.spawning:
+            self.spawn_entities(chunk, self.data.chunk_spawns(i))
+        self.chunks[i] = chunk
+
+    def spawn_entities(self, chunk, spawns):
+        for tile, x, y in spawns:
+            origin = x * self.data.rows + y
+            if origin in self.removed:
+                continue
+            if tile == 15:  # create player, only the first time its chunk is loaded
+                if self.player is None:
+                    self.player = Character('player', x * TILE_SIZE, y * TILE_SIZE, PLAYER_SCALE, 5, 2000)
+                    self.health_bar = HealthBar(10, 10, self.player.max_hp, self.player.hp)
+            elif tile in ENEMY_TILES:  # create slime, knight and shade enemies
+                self.enemies.spawn(tile, x, y, origin)
+            elif tile == 19:  # create health box
+                item_box = ItemBox('Health', x * TILE_SIZE, y * TILE_SIZE)
+                self.item_box_group.add(item_box)
+                chunk.sprites.append(item_box)
+                chunk.item_boxes.append((origin, item_box))
+            elif tile == 20:  # create exit
+                exit = Exit(img_list[tile], x * TILE_SIZE, y * TILE_SIZE)
+                self.exit_group.add(exit)
+                self.grid.insert('exit', exit.rect, exit)
+                chunk.sprites.append(exit)
+
+    def release_chunk(self, i):
+        '''
+        Drop everything a chunk loaded, remembering what was used up
+        '''
+        chunk = self.chunks.pop(i)
+        for origin, item_box in chunk.item_boxes:
+            if not item_box.alive():
+                self.removed.add(origin)
+        for sprite in chunk.sprites:
+            sprite.kill()
+        area = pygame.Rect(i * CHUNK_COLS * TILE_SIZE, 0, CHUNK_COLS * TILE_SIZE, self.data.rows * TILE_SIZE)
+        self.grid.remove('exit', area)
+        self.removed.update(self.enemies.release(i * CHUNK_COLS, (i + 1) * CHUNK_COLS))
+
+    def build_cells(self):
+        '''
+        Collision grids over the loaded columns
+        '''
+        if not self.chunks:
+            return
+        first = min(self.chunks)
+        width = (max(self.chunks) - first + 1) * CHUNK_COLS
+        self.solid = np.zeros((self.data.rows, width), dtype=bool)
+        self.water = np.zeros((self.data.rows, width), dtype=bool)
+        self.first_col = first * CHUNK_COLS
+        for i, chunk in self.chunks.items():
+            cols = slice((i - first) * CHUNK_COLS, (i - first + 1) * CHUNK_COLS)
+            self.solid[:, cols] = chunk.solid
+            self.water[:, cols] = chunk.water
+        self.enemies.set_cells(self.solid, self.water, self.first_col)
+
+    def cell_rects(self, cells, rect):
+        '''
+        World rects of the set cells a rect covers, row by row
+        '''
+        left = max(rect.left // TILE_SIZE - self.first_col, 0)
+        right = min((rect.right - 1) // TILE_SIZE - self.first_col, cells.shape[1] - 1)
+        top = max(rect.top // TILE_SIZE, 0)
+        bottom = min((rect.bottom - 1) // TILE_SIZE, cells.shape[0] - 1)
+        if left > right or top > bottom:
+            return []
+        ys, xs = np.nonzero(cells[top:bottom + 1, left:right + 1])
+        return [pygame.Rect((self.first_col + left + x) * TILE_SIZE, (top + y) * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+                for x, y in zip(xs.tolist(), ys.tolist())]
+
+    def build_zones(self):
+        '''
+        Sort each static sprite group by x once -> the awake sprites are a slice of it
+        '''
+        self.zones = {}
+        for name, group in (('item_box', self.item_box_group), ('exit', self.exit_group)):
+            sprites = sorted(group, key=lambda sprite: sprite.rect.x)
+            self.zones[name] = (sprites, ActivationZone([sprite.rect.x for sprite in sprites]))
+
+    def activate(self, left, right):
+        '''
+        Wake everything near the view, put the rest of the level to sleep
+        '''
+        self.enemies.activate(left, right)
+        for sprites, zone in self.zones.values():
+            zone.update(left, right)
+
+    def awake(self, name):
+        '''
+        Awake sprites of a group, picked up item boxes are skipped
+        '''
+        sprites, zone = self.zones[name]
+        return [sprite for sprite in sprites[zone.lo:zone.hi] if sprite.alive()]
+
+    def clear_sprites(self):
+        '''
+        Remove every non-terrain sprite, used once the last level is finished
+        '''
+        self.spawning = False
+        # snapshots from before would bring the sprites back
+        self.start = None
+        self.effects.clear()
+        self.enemies = EnemyManager(effects=self.effects)
+        for chunk in self.chunks.values():
+            chunk.sprites = []
+            chunk.item_boxes = []
+            chunk.water[:] = False
+            chunk.decoration[:] = False
+        for group in (self.item_box_group, self.exit_group):
+            group.empty()
+        self.grid.layers.pop('exit', None)
+        self.build_cells()
+        self.build_zones()
+
+    def snapshot(self, scroll):
+        '''
+        Everything a respawn puts back -> loaded chunks, entity state, used up spawns and the view's x and previous x
+        '''
+        taken = set(self.removed)
+        for chunk in self.chunks.values():
+            taken.update(origin for origin, item_box in chunk.item_boxes if not item_box.alive())
+        return {
+            'tick': sim_ticks,
+            'chunks': sorted(self.chunks),
+            'removed': taken,
+            'scroll': scroll,
+            'player': self.player.snapshot(),
+            'enemies': self.enemies.snapshot(),
+            'effects': self.effects.rng.bit_generator.state,
+        }
+
+    def checkpoint(self, scroll):
+        '''
+        Snapshot to respawn from, the first one is the level's start
+        '''
+        self.saved = self.snapshot(scroll)
+        if self.start is None:
+            self.start = self.saved
+        width = CHECKPOINT_COLS * TILE_SIZE
+        self.next_checkpoint = (self.player.rect.x // width + 1) * width
+
+    def restore(self, state):
+        '''
+        Put the world back to a snapshot in place -> chunks still loaded are kept and nothing is read from disk
+        Chunks loaded since are released, and chunks released since are rebuilt from the level data
+        '''
+        for i in [i for i in self.chunks if i not in state['chunks']]:
+            self.release_chunk(i)
+        self.removed = set(state['removed'])
+        for i in state['chunks']:
+            if i not in self.chunks:
+                self.load_chunk(i)
+                continue
+            # boxes picked up since come back
+            for origin, item_box in self.chunks[i].item_boxes:
+                if origin in self.removed:
+                    item_box.kill()
+                elif not item_box.alive():
+                    self.item_box_group.add(item_box)
+        elapsed = sim_ticks - state['tick']
+        self.enemies.restore(state['enemies'], elapsed)
+        self.effects.clear()
+        self.effects.rng.bit_generator.state = state['effects']
+        self.player.restore(state['player'], elapsed)
+        camera.x, camera.prev_x = state['scroll']
+        camera.offset = round(camera.x)
+        self.build_cells()
+        self.build_zones()
+
+    def visible_chunks(self):
+        '''
+        Loaded chunks overlapping the viewport
+        '''
+        chunk_width = CHUNK_COLS * TILE_SIZE
+        first = camera.offset // chunk_width
+        last = (camera.offset + SCREEN_WIDTH - 1) // chunk_width
+        return [self.chunks[i] for i in range(first, last + 1) if i in self.chunks]
 
     def draw(self):
-        for tile in self.obstacle_list:
-            tile[1][0] += screen_scroll
-            screen.blit(tile[0], tile[1])
+        if not BAKE_TILES:
+            # only the solid tiles under the viewport
+            self.draw_cells('solid')
+            return
+        for chunk in self.visible_chunks():
+            screen.blit(chunk.surface, (px(chunk.index * CHUNK_COLS * TILE_SIZE - camera.offset), 0))
+            camera.blits += 1
+
+    def draw_cells(self, layer):
+        '''
+        Blit the tiles of one cell layer in the chunks under the viewport in a single call
+        '''
+        blits = []
+        for chunk in self.visible_chunks():
+            ys, xs = np.nonzero(getattr(chunk, layer))
+            left = chunk.index * CHUNK_COLS * TILE_SIZE - camera.offset
+            for tile, x, y in zip(chunk.tiles[ys, xs].tolist(), xs.tolist(), ys.tolist()):
+                if -TILE_SIZE < left + x * TILE_SIZE < camera.width:
+                    blits.append((render_image(img_list[tile]), (px(left + x * TILE_SIZE), px(y * TILE_SIZE))))
+        screen.blits(blits, False)
+        camera.blits += len(blits)
+
+
+class Camera():
+    '''
+    Viewport over the world -> a single x offset applied when drawing
+    '''
+    def __init__(self, width, height):
+        self.x = 0
+        self.width = width
+        self.height = height
+        # x at the start of the tick, interpolated draw offset
+        self.prev_x = 0
+        self.offset = 0
+        self.alpha = 1
+        # blits issued this frame, shown by the profiler
+        self.blits = 0
+
+    def reset(self):
+        self.x = 0
+        self.prev_x = 0
+        self.offset = 0
+
+    def interpolate(self, alpha):
+        '''
+        Place the view between the last two simulation ticks
+        '''
+        self.alpha = alpha
+        self.offset = round(self.prev_x + (self.x - self.prev_x) * alpha)
+        self.blits = 0
+
+    def follow(self, rect, dx, level_width):
+        '''
+        Scroll with the player once they pass the scroll threshold
+        '''
+        if (rect.right - self.x > self.width - SCROLL_THRESHOLD and self.x < level_width - self.width) \
+                or (rect.left - self.x < SCROLL_THRESHOLD and self.x > abs(dx)):
+            self.x += dx
+
+    def visible(self, rect):
+        return rect.right > self.offset and rect.left < self.offset + self.width
+
+    def blit(self, img, rect):
+        '''
+        Draw a world space image on screen, skipping it when off screen
+        '''
+        if self.visible(rect):
+            screen.blit(render_image(img), (px(rect.x - self.offset), px(rect.y)))
+            self.blits += 1
+
+    def draw_group(self, group):
+        for sprite in group:
+            self.blit(sprite.image, sprite.rect)
 
 class Exit(pygame.sprite.Sprite):
     '''
@@ -447,9 +1775,6 @@ class Exit(pygame.sprite.Sprite):
         self.rect = self.image.get_rect()
         self.rect.midtop = (x + TILE_SIZE // 2, y + (TILE_SIZE - self.image.get_height()))
 
-    def update(self):
-        self.rect.x += screen_scroll
-
 class ItemBox(pygame.sprite.Sprite):
     '''
     ItemBox sprites -> included for world-filling material
@@ -462,7 +1787,6 @@ class ItemBox(pygame.sprite.Sprite):
         self.rect.midtop = (x + TILE_SIZE // 2, y + (TILE_SIZE - self.image.get_height()))
 
     def update(self):
-        self.rect.x += screen_scroll
         #check if the player has picked up the box
         if pygame.sprite.collide_rect(self, player):
             #check what kind of box it was
@@ -473,31 +1797,160 @@ class ItemBox(pygame.sprite.Sprite):
             #delete the item box
             self.kill()
 
-class Decoration(pygame.sprite.Sprite):
+class DirtyRenderer():
     '''
-    Create sprites for decorations -> grass, rocks, etc.
+    Pushes only the changed regions of the screen to the display
+    A frame smaller than the window is scaled up once per presented frame
     '''
-    def __init__(self, img, x, y):
-        pygame.sprite.Sprite.__init__(self)
-        self.image = img
-        self.rect = self.image.get_rect()
-        self.rect.midtop = (x + TILE_SIZE // 2, y + (TILE_SIZE - self.image.get_height()))
+    def __init__(self, widgets, frame, window, smooth=False, whole=True):
+        self.widgets = widgets
+        self.rects = []
+        # whole screen needs repainting and pushing
+        self.full = True
+        self.frame = frame
+        self.window = window
+        self.smooth = smooth
+        # scale by whole factors only -> off for a reduced frame, its pixels are resampled already
+        self.whole = whole
+        self.fit()
+
+    def fit(self):
+        '''
+        Centre the scaled frame in the window -> view is the window area it covers
+        '''
+        frame_width, frame_height = self.frame.get_size()
+        width, height = self.window.get_size()
+        scale = min(width / frame_width, height / frame_height)
+        if self.whole and not self.smooth and scale >= 1:
+            # whole factors keep every pixel square
+            scale = int(scale)
+        size = (int(frame_width * scale), int(frame_height * scale))
+        self.view = pygame.Rect(((width - size[0]) // 2, (height - size[1]) // 2), size)
+        # scaled straight into the display, bars either side are filled on full repaints
+        self.target = None if self.window is self.frame else self.window.subsurface(self.view)
+        self.bars = [pygame.Rect(0, 0, width, self.view.top),
+                     pygame.Rect(0, self.view.bottom, width, height - self.view.bottom),
+                     pygame.Rect(0, 0, self.view.left, height),
+                     pygame.Rect(self.view.right, 0, width - self.view.right, height)]
+        self.invalidate()
+
+    def to_window(self, rect):
+        '''
+        Window area a frame rect ends up in, rounded outwards
+        '''
+        frame_width, frame_height = self.frame.get_size()
+        left = self.view.x + rect.left * self.view.width // frame_width
+        top = self.view.y + rect.top * self.view.height // frame_height
+        right = self.view.x - (-rect.right * self.view.width // frame_width)
+        bottom = self.view.y - (-rect.bottom * self.view.height // frame_height)
+        return pygame.Rect(left, top, right - left, bottom - top)
+
+    def to_frame(self, pos):
+        '''
+        Frame pixel under a window position, e.g. the mouse
+        '''
+        frame_width, frame_height = self.frame.get_size()
+        return ((pos[0] - self.view.x) * frame_width // self.view.width,
+                (pos[1] - self.view.y) * frame_height // self.view.height)
 
-    def update(self):
-        self.rect.x += screen_scroll
+    def mouse_pos(self):
+        return self.to_frame(pygame.mouse.get_pos())
 
-class Water(pygame.sprite.Sprite):
+    def invalidate(self):
+        '''
+        Whole screen repainted -> widgets need drawing again on top of it
+        '''
+        self.full = True
+        for widget in self.widgets:
+            widget.dirty = True
+
+    def mark(self, rect):
+        self.rects.append(rect)
+
+    def present(self):
+        if self.target is not None and (self.full or self.rects):
+            # one scaling pass of the whole frame, partial updates still only push their area
+            if self.smooth:
+                pygame.transform.smoothscale(self.frame, self.view.size, self.target)
+            else:
+                pygame.transform.scale(self.frame, self.view.size, self.target)
+            if self.full:
+                for bar in self.bars:
+                    self.window.fill(BLACK, bar)
+            self.rects = [self.to_window(rect) for rect in self.rects]
+        if self.full:
+            pygame.display.update()
+        elif self.rects:
+            pygame.display.update(self.rects)
+        self.full = False
+        self.rects = []
+
+class PhaseTimer():
     '''
-    Create sprites for water
+    Wall-clock time spent in each phase of the current frame
     '''
-    def __init__(self, img, x, y):
-        pygame.sprite.Sprite.__init__(self)
-        self.image = img
-        self.rect = self.image.get_rect()
-        self.rect.midtop = (x + TILE_SIZE // 2, y + (TILE_SIZE - self.image.get_height()))
+    def __init__(self):
+        # phase name: seconds
+        self.phases = {}
+        self.name = None
+        self.start_time = 0
 
-    def update(self):
-        self.rect.x += screen_scroll
+    def frame(self):
+        '''
+        Start timing a new frame
+        '''
+        self.phases = {}
+        self.name = None
+
+    def begin(self, name):
+        '''
+        Close the running phase and start timing the next one
+        '''
+        now = time.perf_counter()
+        if self.name is not None:
+            self.phases[self.name] = self.phases.get(self.name, 0) + now - self.start_time
+        self.name = name
+        self.start_time = now
+
+    def end(self):
+        self.begin(None)
+
+class QualityGovernor():
+    '''
+    Rolling average of the work time per frame -> quality level stepped down when over budget, up with headroom
+    '''
+    def __init__(self, budget, level=0):
+        self.budget = budget
+        self.level = level
+        self.enabled = True
+        self.times = []
+
+    def record(self, secs):
+        '''
+        Add a frame's work time, after a change a full window is measured before the next
+        '''
+        if not self.enabled:
+            return
+        self.times.append(secs)
+        if len(self.times) < QUALITY_WINDOW:
+            return
+        average = sum(self.times) / len(self.times)
+        del self.times[0]
+        if average > self.budget * QUALITY_DOWN and self.level < MAX_QUALITY_LEVEL:
+            self.level += 1
+        elif average < self.budget * QUALITY_UP and self.level > 0:
+            self.level -= 1
+        else:
+            return
+        self.times = []
+        # everything is drawn differently from here
+        renderer.invalidate()
+
+def animation_due():
+    '''
+    Whether animation timers advance this tick, every tick unless quality is lowered
+    '''
+    return quality.level < SLOW_ANIMATION or sim_ticks % ANIMATION_STRIDE == 0
 
 class ScreenFade():
     '''
@@ -510,102 +1963,147 @@ class ScreenFade():
         self.fade_counter = 0
 
 
+    def update(self):
+        '''
+        Advance the fade by one simulation tick
+        '''
+        self.fade_counter += self.speed
+        return self.fade_counter >= SCREEN_WIDTH
+
     def fade(self):
         fade_complete = False
-        self.fade_counter += self.speed
+        # drawn in frame pixels
+        counter = px(self.fade_counter)
         if self.direction == 1: # whole screen fade
-            pygame.draw.rect(screen, self.color, (0 - self.fade_counter, 0, SCREEN_WIDTH // 2, SCREEN_HEIGHT))
-            pygame.draw.rect(screen, self.color, (SCREEN_WIDTH // 2 + self.fade_counter, 0, SCREEN_WIDTH, SCREEN_HEIGHT))
-            pygame.draw.rect(screen, self.color, (0, 0 - self.fade_counter, SCREEN_WIDTH, SCREEN_HEIGHT // 2))
-            pygame.draw.rect(screen, self.color, (0, SCREEN_HEIGHT // 2 +self.fade_counter, SCREEN_WIDTH, SCREEN_HEIGHT))
+            pygame.draw.rect(screen, self.color, (0 - counter, 0, FRAME_WIDTH // 2, FRAME_HEIGHT))
+            pygame.draw.rect(screen, self.color, (FRAME_WIDTH // 2 + counter, 0, FRAME_WIDTH, FRAME_HEIGHT))
+            pygame.draw.rect(screen, self.color, (0, 0 - counter, FRAME_WIDTH, FRAME_HEIGHT // 2))
+            pygame.draw.rect(screen, self.color, (0, FRAME_HEIGHT // 2 +counter, FRAME_WIDTH, FRAME_HEIGHT))
         if self.direction == 2: # vertical screen fade down
-            pygame.draw.rect(screen, self.color, (0, 0, SCREEN_WIDTH, 0 + self.fade_counter))
+            pygame.draw.rect(screen, self.color, (0, 0, FRAME_WIDTH, 0 + counter))
         if self.fade_counter >= SCREEN_WIDTH:
             fade_complete = True
 
         return fade_complete
 
+# world viewport
+camera = Camera(SCREEN_WIDTH, SCREEN_HEIGHT)
+parallax_layers = []
 #create screen fades
 intro_fade = ScreenFade(1, BLACK, 6)
 death_fade = ScreenFade(2, RED, 6)
-# create menu buttons
-start_button = button.Button(SCREEN_WIDTH // 2 - 130, SCREEN_HEIGHT // 2 - 150, start_img, 1)
-exit_button = button.Button(SCREEN_WIDTH // 2 - 110, SCREEN_HEIGHT // 2 + 50, exit_img, 1)
-restart_button = button.Button(SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT // 2 - 50, restart_img, 2)
-
-# create sprite groups
-player_group = pygame.sprite.Group()
-enemy_group = pygame.sprite.Group()
-item_box_group = pygame.sprite.Group()
-decoration_group = pygame.sprite.Group()
-water_group = pygame.sprite.Group()
-exit_group = pygame.sprite.Group()
-
-
-#create empty tile list
-world_data = []
-for row in range(ROWS):
-	r = [-1] * COLS
-	world_data.append(r)
-#load in level data and create world
-with open(f'level{level}_data.csv', newline='') as csvfile:
-	reader = csv.reader(csvfile, delimiter=',')
-	for x, row in enumerate(reader):
-		for y, tile in enumerate(row):
-			world_data[x][y] = int(tile)
-world = World()
-player, health_bar = world.process_data(world_data)
-
+# create menu buttons, placed and sized in frame pixels
+start_button = button.Button(px(SCREEN_WIDTH // 2 - 130), px(SCREEN_HEIGHT // 2 - 150), start_img, RENDER_SCALE)
+# enabled once the loader is done
+start_button.enabled = False
+exit_button = button.Button(px(SCREEN_WIDTH // 2 - 110), px(SCREEN_HEIGHT // 2 + 50), exit_img, RENDER_SCALE)
+restart_button = button.Button(px(SCREEN_WIDTH // 2 - 100), px(SCREEN_HEIGHT // 2 - 50), restart_img, 2 * RENDER_SCALE)
+renderer = DirtyRenderer([start_button, exit_button, restart_button], screen, window, SMOOTH_SCALE, RENDER_SCALE == 1)
+phase_timer = PhaseTimer()
+quality = QualityGovernor(1 / (FPS or 60), QUALITY_LEVEL or 0)
+# changes the simulation -> off for recordings, replays, headless runs and imports by bench or environment,
+# which must be reproducible
+quality.enabled = ADAPTIVE_QUALITY and QUALITY_LEVEL is None and recorder is None and playback is None \
+    and not HEADLESS and __name__ == '__main__'
+# F3 shows the per-phase timing overlay, F4 dumps its buffer
+frame_profiler = profiler.Profiler()
+
+
+
+if BUILD_ASSETS:
+    animations = [('player', PLAYER_SCALE, PLAYER_ANIMATIONS)]
+    animations += [(char_type, scale, ENEMY_ANIMATIONS) for char_type, scale, *stats in ENEMY_KINDS]
+    images, pages = assets.build('imgs', TILE_SIZE, TILE_TYPES, animations)
+    print(f'packed {images} images into {pages} atlas pages under imgs/atlas')
+    pygame.quit()
+    sys.exit()
 
 run = True
-while run:
-    clock.tick(FPS)
-    if start_game == False:
-        # draw menu
-        screen.fill(BG)
-        # add buttons
-        if start_button.draw(screen):
-            start_game = True
-            start_intro = True
-        if exit_button.draw(screen):
-            run = False
-    else:
-        # draw background
-        draw_bg()
-        # draw world
-        world.draw()
-        # player health
-        health_bar.draw(player.hp)
-        player.update()
-        player.draw()
+world = player = health_bar = None
+# next level is built in the background while this one is played
+prefetcher = LevelPrefetcher()
 
-        for enemy in enemy_group:
-            enemy.ai()
-            enemy.update()
-            enemy.draw()
-            # ['idle', 'move', 'die', 'hit', 'attack']
-            if enemy.alive:
-                if enemy.hit:
-                    enemy.update_action(3)
-                    enemy.hit = False
-
-        # update and draw sprite groups
-        decoration_group.update()
-        water_group.update()
-        exit_group.update()
-        item_box_group.update()
-
-        decoration_group.draw(screen)
-        item_box_group.draw(screen)
-        water_group.draw(screen)
-        exit_group.draw(screen)
+def load_backgrounds():
+    global parallax_layers
+    parallax_layers = build_parallax()
 
-        # show intro
-        if start_intro == True:
-            if intro_fade.fade():
-                start_intro = False
-                intro_fade.fade_counter = 0
+def load_characters():
+    load_animations('player', PLAYER_SCALE)
+    for char_type, scale, *stats in ENEMY_KINDS:
+        load_animations(char_type, scale)
+
+def load_first_level():
+    '''
+    Load in level data and create world
+    '''
+    global world, player, health_bar
+    world, player, health_bar = load_world(level)
+
+# the menu is up while these run, Start is enabled once they are done
+loader = AssetLoader([load_images, load_backgrounds, load_characters, load_first_level])
+loader.start()
+if __name__ != '__main__' or HEADLESS or playback is not None:
+    # nothing to show while waiting -> carry on once everything is loaded
+    loader.wait()
 
+
+def restart_level(code=RESPAWN_CODE):
+    '''
+    Respawn at the level's last checkpoint after the player died, RESTART_CODE goes back to its start
+    The world is restored in place, no level data or images are loaded again
+    '''
+    global start_intro
+    death_fade.fade_counter = 0
+    start_intro = True
+    if recorder is not None:
+        recorder.add(sim_ticks, code)
+    world.restore(world.saved if code == RESPAWN_CODE else world.start)
+    # respawns come back at full health
+    player.hp = player.max_hp
+
+def update():
+    '''
+    Advance the game simulation by one fixed timestep tick, nothing is drawn
+    '''
+    global world, player, health_bar, level, start_intro, sim_ticks, session_digest
+    if start_game == False:
+        return
+    if playback is not None:
+        play_inputs(playback.take(sim_ticks))
+    if recorder is not None or playback is not None:
+        session_digest = state_digest()
+    sim_ticks += 1
+    # only what is near the view is loaded and simulated
+    phase_timer.begin('stream')
+    world.stream(camera.x, camera.x + camera.width)
+    world.activate(camera.x, camera.x + camera.width)
+    # remember where everything was for interpolated drawing
+    phase_timer.begin('player')
+    camera.prev_x = camera.x
+    player.store_previous()
+    phase_timer.begin('enemies')
+    world.enemies.store_previous()
+    # fades run on simulation time too
+    phase_timer.begin('fades')
+    if start_intro == True:
+        if intro_fade.update():
+            start_intro = False
+            intro_fade.fade_counter = 0
+    if not player.alive:
+        death_fade.update()
+    phase_timer.begin('player')
+    player.update()
+    phase_timer.begin('enemies')
+    # ['idle', 'move', 'die', 'hit', 'attack']
+    world.enemies.ai(player)
+    world.enemies.update()
+    phase_timer.begin('sprites')
+    for item_box in world.awake('item_box'):
+        item_box.update()
+    phase_timer.begin('effects')
+    world.effects.update(world.solid, world.first_col, world.enemies)
+
+    phase_timer.begin('player')
     # update player action while player is alive
     # anime_types = ['idle', 'move', 'die', 'hit', 'attack' 'jump', 'slide', 'crouch']
     if player.alive:
@@ -624,47 +2122,165 @@ while run:
             player.update_action(1) # running
         else:
             player.update_action(0) # idle
-        screen_scroll, level_complete = player.move(moving_left, moving_right)
-        bg_scroll -= screen_scroll
+        if player.throw:
+            player.throw_knife()
+        level_complete = player.move(moving_left, moving_right)
+        if player.grounded and player.hp > 0 and player.rect.x >= world.next_checkpoint:
+            world.checkpoint((camera.x, camera.prev_x))
         # if level completed -> jump to next level
         if level_complete:
             start_intro = True
             level += 1
-            bg_scroll = 0
-            world_data = reset_level()
+            camera.reset()
             if level <= MAX_LEVELS:
-                # load in level data and create world
-                with open(f'level{level}_data.csv', newline='') as csvfile:
-                    reader = csv.reader(csvfile, delimiter=',')
-                    for x, row in enumerate(reader):
-                        for y, tile in enumerate(row):
-                            world_data[x][y] = int(tile)
-                world = World()
-                player, health_bar = world.process_data(world_data)
-    # if player dies -> show restart button
-    elif not player.alive:
+                # swap in the prefetched world
+                world, player, health_bar = prefetcher.take(level)
+                prefetcher.start(level + 1)
+                # timers of a world built on the prefetch thread start once it is played
+                player.update_time = sim_ticks
+                world.enemies.restart_clock()
+            else:
+                world.clear_sprites()
+                world.checkpoint((camera.x, camera.prev_x))
+    else:
         player.update_action(2) # dies
-        if death_fade.fade():
-            if restart_button.draw(screen):
-                death_fade.fade_counter = 0
-                start_intro = True
-                screen_scroll = 0
-                bg_scroll = 0
-                world_data = reset_level()
-                # load in level data and create world
-                with open(f'level{level}_data.csv', newline='') as csvfile:
-                    reader = csv.reader(csvfile, delimiter=',')
-                    for x, row in enumerate(reader):
-                        for y, tile in enumerate(row):
-                            world_data[x][y] = int(tile)
-                world = World()
-                player, health_bar = world.process_data(world_data)
+    phase_timer.end()
 
+def draw(alpha=1):
+    '''
+    Render the current frame, alpha of the way from the previous tick to the latest
+    Menus and buttons are handled here too
+    '''
+    global start_game, start_intro, run
+    camera.interpolate(alpha)
+    # overlay is redrawn every frame -> no static screens while it is shown
+    if frame_profiler.visible:
+        renderer.invalidate()
+    if start_game == False:
+        if loader.ready and not start_button.enabled:
+            # loading finished -> repaint the menu without the progress bar
+            start_button.enabled = True
+            renderer.invalidate()
+        # draw menu, only repainted when the screen was invalidated
+        if renderer.full:
+            screen.fill(BG)
+        draw_loading()
+        # add buttons
+        if start_button.draw(screen, renderer.rects, renderer.mouse_pos()):
+            start_game = True
+            start_intro = True
+        if exit_button.draw(screen, renderer.rects, renderer.mouse_pos()):
+            run = False
+        draw_profiler()
+        return
+    # death screen is static once fully faded in
+    death_screen = not player.alive and death_fade.fade_counter >= SCREEN_WIDTH
+    if death_screen:
+        if renderer.full:
+            screen.fill(death_fade.color)
+    else:
+        # whole scene is redrawn
+        renderer.invalidate()
+        # draw background
+        phase_timer.begin('draw_bg')
+        draw_bg()
+        # draw world
+        phase_timer.begin('draw_world')
+        world.draw()
+        # player health
+        phase_timer.begin('draw_player')
+        health_bar.draw(player.hp)
+        player.draw()
+        phase_timer.begin('draw_enemies')
+        world.enemies.draw()
+        phase_timer.begin('draw_effects')
+        world.effects.draw()
+
+        # draw sprite groups
+        phase_timer.begin('draw_sprites')
+        if quality.level < DROP_DECORATIONS:
+            world.draw_cells('decoration')
+        camera.draw_group(world.awake('item_box'))
+        world.draw_cells('water')
+        camera.draw_group(world.awake('exit'))
+
+        # show intro
+        phase_timer.begin('draw_fades')
+        if start_intro == True:
+            intro_fade.fade()
+
+    # if player dies -> show restart button
+    phase_timer.begin('draw_fades')
+    if not player.alive:
+        if death_screen or death_fade.fade():
+            # a replay restarts when its recording did
+            if restart_button.draw(screen, renderer.rects, renderer.mouse_pos()) and playback is None:
+                restart_level()
+    draw_profiler()
+    phase_timer.end()
+
+def draw_loading():
+    '''
+    Progress bar under the start button while the loader runs
+    '''
+    if loader.error is not None:
+        raise loader.error
+    if loader.ready:
+        return
+    rect = pygame.Rect(px(SCREEN_WIDTH // 2 - 150), px(SCREEN_HEIGHT // 2 - 20), px(300), px(12))
+    pygame.draw.rect(screen, BG, rect)
+    pygame.draw.rect(screen, WHITE, rect, 1)
+    pygame.draw.rect(screen, WHITE, (rect.x + 2, rect.y + 2, int((rect.width - 4) * loader.progress), rect.height - 4))
+    renderer.mark(rect)
+
+def draw_profiler():
+    if frame_profiler.visible:
+        phase_timer.end()
+        rect = frame_profiler.draw(screen, FRAME_WIDTH - frame_profiler.size - 10, 10)
+        renderer.mark(rect)
+
+def record_frame():
+    '''
+    Hand the finished frame's timings to the profiler
+    '''
+    entities = len(world.enemies.zone) + 1 if world is not None else 0
+    frame_profiler.record(phase_timer.phases, entities, camera.blits, quality.level)
+
+def is_input(event):
+    return event.type in (pygame.KEYDOWN, pygame.KEYUP) and event.key in INPUT_KEYS
+
+def input_code(event):
+    return INPUT_KEYS.index(event.key) * 2 + (event.type == pygame.KEYUP)
+
+def play_inputs(codes):
+    '''
+    Apply recorded input codes in the order they were recorded
+    '''
+    for code in codes:
+        if code in (RESTART_CODE, RESPAWN_CODE):
+            restart_level(code)
+        else:
+            event_type = pygame.KEYUP if code % 2 else pygame.KEYDOWN
+            handle_events([pygame.event.Event(event_type, key=INPUT_KEYS[code // 2])])
+
+def handle_events(events):
+    '''
+    Apply a frame's worth of input events to the player
+    '''
+    global run, moving_left, moving_right
     # keymapping
-    for event in pygame.event.get():
+    for event in events:
+        # no player to steer until the loader is done
+        if is_input(event) and not loader.ready:
+            continue
+        if recorder is not None and is_input(event):
+            recorder.add(sim_ticks, input_code(event))
         # quits game
         if event.type == pygame.QUIT:
             run = False
+        # window contents lost -> repaint everything
+        if event.type == pygame.VIDEOEXPOSE:
+            renderer.invalidate()
         # key pressed
         if event.type == pygame.KEYDOWN:
             # move left
@@ -693,6 +2309,15 @@ while run:
                 moving_right = False
                 player.slide = False
                 player.attack = True
+            # throwing
+            if event.key == pygame.K_f:
+                player.throw = True
+            # profiler overlay and dump
+            if event.key == pygame.K_F3:
+                frame_profiler.toggle()
+                renderer.invalidate()
+            if event.key == pygame.K_F4:
+                print('profile written to', frame_profiler.dump())
             # escape exits game
             if event.key == pygame.K_ESCAPE:
                 run = False
@@ -708,5 +2333,155 @@ while run:
             # if event.key == pygame.K_SPACE:
             #     player.attack = False
             # breaks animation logic, placed elsewhere
-    pygame.display.update()
-pygame.quit()
\ No newline at end of file
+
+def step(events, render=True):
+    '''
+    Run one simulation tick of the game loop, render=False skips every blit
+    '''
+    phase_timer.frame()
+    phase_timer.begin('events')
+    handle_events(events)
+    update()
+    if render:
+        draw()
+        phase_timer.begin('display')
+        renderer.present()
+        phase_timer.end()
+    record_frame()
+    return run
+
+class ScriptedInput():
+    '''
+    Programmatic input source -> key presses and releases scheduled by frame
+    '''
+    def __init__(self, script=None):
+        # frame number: [(pygame.KEYDOWN / pygame.KEYUP, key), ...]
+        self.script = script or {}
+
+    def get(self, frame):
+        return [pygame.event.Event(event_type, key=key) for event_type, key in self.script.get(frame, ())]
+
+def soak_script(frames):
+    '''
+    Run right for the whole session, jumping, attacking and throwing at regular intervals
+    '''
+    script = {0: [(pygame.KEYDOWN, pygame.K_d)]}
+    for frame in range(frames):
+        if frame % 25 == 10:
+            script.setdefault(frame, []).append((pygame.KEYDOWN, pygame.K_w))
+        if frame % 120 == 60:
+            script.setdefault(frame, []).append((pygame.KEYDOWN, pygame.K_SPACE))
+        if frame % 40 == 20:
+            script.setdefault(frame, []).append((pygame.KEYDOWN, pygame.K_f))
+        if frame % 120 == 62:
+            script.setdefault(frame, []).append((pygame.KEYDOWN, pygame.K_d))
+    return ScriptedInput(script)
+
+def run_headless(frames, inputs=None):
+    '''
+    Simulate frames as fast as possible with no rendering or frame cap
+    '''
+    global start_game
+    if inputs is None:
+        inputs = soak_script(frames)
+    prefetcher.start(level + 1)
+    start_game = True
+    start_time = time.perf_counter()
+    stepped = 0
+    for frame in range(frames):
+        stepped += 1
+        if not step(inputs.get(frame), render=False):
+            break
+        # no restart button to click -> respawn straight away
+        if not player.alive:
+            restart_level()
+    elapsed = time.perf_counter() - start_time
+    return stepped, elapsed
+
+def state_digest():
+    '''
+    Checksum of the simulated state chained onto the earlier ticks' -> a replay matches its recording when they agree
+    '''
+    enemies = world.enemies.columns
+    state = np.concatenate((enemies['x'], enemies['y'], enemies['hp'], enemies['action'],
+                            [sim_ticks, level, player.rect.x, player.rect.y, player.hp]))
+    return zlib.crc32(state.astype(np.int64).tobytes(), session_digest)
+
+def save_recording():
+    recorder.ticks = sim_ticks
+    recorder.digest = state_digest()
+    replay.save(recorder, RECORD_PATH)
+
+def play(recording, render=True):
+    '''
+    Re-run a recorded session tick by tick, True when every tick's state matched the recording
+    '''
+    global start_game, start_intro
+    prefetcher.start(level + 1)
+    start_game = True
+    start_intro = True
+    start_time = time.perf_counter()
+    while run and sim_ticks < recording.ticks:
+        # live game keys would change the run -> only quit and the profiler keys get through
+        events = [event for event in pygame.event.get() if not is_input(event)] if render else []
+        step(events, render)
+        if render:
+            clock.tick(SIM_RATE)
+    elapsed = time.perf_counter() - start_time
+    return sim_ticks == recording.ticks and state_digest() == recording.digest, elapsed
+
+def main():
+    '''
+    Windowed loop -> fixed timestep simulation, rendering as often as FPS allows
+    '''
+    accumulator = 0
+    previous = time.perf_counter()
+    prefetching = False
+    while run:
+        now = time.perf_counter()
+        accumulator += min(now - previous, MAX_FRAME_TIME)
+        previous = now
+        # the next level is built in the background once the loader has built this one
+        if loader.ready and not prefetching:
+            prefetcher.start(level + 1)
+            prefetching = True
+        phase_timer.frame()
+        phase_timer.begin('events')
+        handle_events(pygame.event.get())
+        while accumulator >= SIM_DT:
+            update()
+            accumulator -= SIM_DT
+        draw(accumulator / SIM_DT)
+        phase_timer.begin('display')
+        renderer.present()
+        phase_timer.end()
+        record_frame()
+        # work time only, the wait in clock.tick is headroom
+        quality.record(time.perf_counter() - now)
+        clock.tick(FPS)
+    # quitting mid load -> let the loader finish before pygame goes away
+    loader.wait()
+    prefetcher.wait()
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    if playback is not None:
+        matches, elapsed = play(playback, render=not HEADLESS)
+        print(f'replayed {sim_ticks} ticks in {elapsed:.2f}s, level {level},',
+              'state matches the recording' if matches else 'state differs from the recording')
+        prefetcher.wait()
+        pygame.quit()
+        if not matches:
+            sys.exit(1)
+    elif HEADLESS:
+        frames = int(sys.argv[sys.argv.index('--frames') + 1]) if '--frames' in sys.argv else 10000
+        frames, elapsed = run_headless(frames)
+        print(f'{frames} frames in {elapsed:.2f}s ({frames / elapsed if elapsed else 0:.0f} fps), level {level}')
+        prefetcher.wait()
+        pygame.quit()
+    else:
+        main()
+    if recorder is not None:
+        save_recording()
+        print(f'recorded {sim_ticks} ticks to {RECORD_PATH}')
@@ -0,0 +1,155 @@
+import json
+import os
+
+import pygame
+
+# atlas pages are at most PAGE_SIZE square, images are packed onto shelves of decreasing height
+PAGE_SIZE = 2048
+# one pixel gap so neighbouring images never bleed into each other
+PADDING = 1
+# raw pixels in the usual display byte order -> loading is one copy, no png decode
+PIXEL_FORMAT = 'BGRA'
+VERSION = 1
+
+
+def source_mtime(root):
+    '''
+    Newest modification time (ns) of any image under root
+    '''
+    newest = 0
+    for path, dirs, files in os.walk(root):
+        # the atlas never counts as its own source
+        dirs[:] = [name for name in dirs if os.path.join(path, name) != os.path.join(root, 'atlas')]
+        for name in files:
+            if name.endswith('.png'):
+                newest = max(newest, os.stat(os.path.join(path, name)).st_mtime_ns)
+    return newest
+
+
+def animation_key(char_type, scale):
+    return f'{char_type}@{scale:g}'
+
+
+def scaled(img, scale):
+    return pygame.transform.scale(img, (int(img.get_width() * scale), int(img.get_height() * scale)))
+
+
+def collect(root, tile_size, tile_types, animations):
+    '''
+    Every image the game draws, already scaled -> {name: surface} plus per animation frame counts
+    '''
+    images = {}
+    for x in range(tile_types):
+        img = pygame.image.load(os.path.join(root, 'tile', f'{x}.png'))
+        images[f'tile/{x}'] = pygame.transform.scale(img, (tile_size, tile_size))
+    # menu buttons are drawn before the atlas loads -> not packed
+    for name in ('background/pine1', 'background/pine2', 'background/mountain', 'background/sky_cloud',
+                 'icons/health_box'):
+        images[name] = pygame.image.load(os.path.join(root, f'{name}.png'))
+    frame_counts = {}
+    for char_type, scale, anime_types in animations:
+        key = animation_key(char_type, scale)
+        frame_counts[key] = []
+        for animation in anime_types:
+            count = len(os.listdir(os.path.join(root, char_type, animation)))
+            frame_counts[key].append(count)
+            for i in range(count):
+                img = pygame.image.load(os.path.join(root, char_type, animation, f'{i}.png'))
+                images[f'{key}/{animation}/{i}'] = scaled(img, scale)
+    return images, frame_counts
+
+
+def pack(sizes):
+    '''
+    Shelf pack (name, width, height) items -> {name: (page, x, y)} and the used height of each page
+    '''
+    places = {}
+    heights = []
+    x = y = shelf = 0
+    for name, width, height in sorted(sizes, key=lambda item: (-item[2], -item[1])):
+        if x + width > PAGE_SIZE:
+            # next shelf
+            x = 0
+            y += shelf + PADDING
+            shelf = 0
+        if not heights or y + height > PAGE_SIZE:
+            heights.append(0)
+            x = y = shelf = 0
+        places[name] = (len(heights) - 1, x, y)
+        x += width + PADDING
+        shelf = max(shelf, height)
+        heights[-1] = max(heights[-1], y + height)
+    return places, heights
+
+
+def build(root, tile_size, tile_types, animations):
+    '''
+    Pack every scaled image into atlas pages under root/atlas with a JSON index
+    animations: (char_type, scale, animation names) for every character the game animates
+    '''
+    images, frame_counts = collect(root, tile_size, tile_types, animations)
+    places, heights = pack([(name, img.get_width(), img.get_height()) for name, img in images.items()])
+    pages = [pygame.Surface((PAGE_SIZE, height), pygame.SRCALPHA) for height in heights]
+    index = {}
+    for name, (page, x, y) in places.items():
+        img = images[name]
+        pages[page].blit(img, (x, y))
+        index[name] = [page, x, y, img.get_width(), img.get_height()]
+    out = os.path.join(root, 'atlas')
+    os.makedirs(out, exist_ok=True)
+    page_names = []
+    for i, surface in enumerate(pages):
+        page_names.append([f'atlas_{i}.raw', surface.get_width(), surface.get_height()])
+        with open(os.path.join(out, page_names[-1][0]), 'wb') as f:
+            f.write(pygame.image.tobytes(surface, PIXEL_FORMAT))
+    with open(os.path.join(out, 'atlas.json'), 'w') as f:
+        json.dump({
+            'version': VERSION,
+            'tile_size': tile_size,
+            'source_mtime': source_mtime(root),
+            'pages': page_names,
+            'frame_counts': frame_counts,
+            'images': index,
+        }, f)
+    return len(images), len(pages)
+
+
+class Atlas():
+    '''
+    Atlas pages loaded once and converted -> every image is a subsurface of its page
+    '''
+    def __init__(self, index, pages):
+        self.index = index
+        self.pages = pages
+
+    def get(self, name):
+        place = self.index['images'].get(name)
+        if place is None:
+            return None
+        page, x, y, width, height = place
+        return self.pages[page].subsurface((x, y, width, height))
+
+    def frame_counts(self, char_type, scale):
+        return self.index['frame_counts'].get(animation_key(char_type, scale))
+
+
+def load(root, tile_size):
+    '''
+    Load the built atlas, None if it is missing, stale or built for another tile size
+    '''
+    try:
+        with open(os.path.join(root, 'atlas', 'atlas.json')) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != VERSION or index.get('tile_size') != tile_size \
+            or index.get('source_mtime') != source_mtime(root):
+        return None
+    pages = []
+    try:
+        for name, width, height in index['pages']:
+            with open(os.path.join(root, 'atlas', name), 'rb') as f:
+                pages.append(pygame.image.frombuffer(f.read(), (width, height), PIXEL_FORMAT).convert_alpha())
+    except (OSError, ValueError, pygame.error):
+        return None
+    return Atlas(index, pages)
@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+
+# the benchmark never opens a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+import app
+from leveldata import leveldata
+from replay import replay
+
+LEVELS = ['level1', 'level2', 'level3']
+STRESS = ['stress_100', 'stress_500', 'stress_2000']
+# streamed levels, one enemy every 20 columns
+LONG = ['long_20000']
+# levels and stress scenarios share one seed -> every build plays the same run
+SEED = 0
+
+
+def stress_level(enemies, cols=600):
+    '''
+    Synthetic level -> full width floor, a platform lane and evenly spread enemies
+    '''
+    rows = app.ROWS
+    tiles = array('b', [-1] * (rows * cols))
+    for x in range(cols):
+        for y in (rows - 2, rows - 1):
+            tiles[y * cols + x] = 0
+        # broken platform lane so every chunk has tiles to collide with
+        if x % 8 < 5:
+            tiles[(rows - 6) * cols + x] = 4
+    spawns = [(15, 2, rows - 3)]
+    for i in range(enemies):
+        x = 10 + i * (cols - 20) // enemies
+        spawns.append((16 + i % 3, x, rows - 3))
+    spawns.append((20, cols - 2, rows - 3))
+    return leveldata.LevelData(rows, cols, tiles, spawns)
+
+
+def compiled_long_level(cols):
+    '''
+    Compile a long stress level to a temporary file once -> scenarios stream it like a real level
+    '''
+    path = os.path.join(tempfile.gettempdir(), f'bench_long_{cols}.lvl')
+    if leveldata.read_compiled(path, 0, app.CHUNK_COLS) is None:
+        data = stress_level(cols // 20, cols)
+        data.chunk_cols = app.CHUNK_COLS
+        leveldata.write_compiled(data, path, 0)
+    return path
+
+
+def load_scenario(name):
+    '''
+    Build a scenario's world and make it the game's current one
+    '''
+    app.camera.reset()
+    app.seed = SEED
+    app.playback = None
+    if name.endswith('.rpl'):
+        # recorded session -> its own seed, start level and input from the first tick
+        app.playback = replay.load(name)
+        app.seed = app.playback.seed
+        app.level = app.playback.level
+        app.sim_ticks = 0
+        app.session_digest = 0
+        world, player, health_bar = app.load_world(app.level)
+        app.prefetcher.start(app.level + 1)
+    elif name.startswith('level'):
+        app.level = int(name[len('level'):])
+        world, player, health_bar = app.load_world(app.level)
+    elif name.startswith('long'):
+        path = compiled_long_level(int(name.split('_')[1]))
+        world, player, health_bar = app.build_world(leveldata.read_compiled(path, 0, app.CHUNK_COLS), (SEED, 0))
+    else:
+        world, player, health_bar = app.build_world(stress_level(int(name.split('_')[1])), (SEED, 0))
+    app.world, app.player, app.health_bar = world, player, health_bar
+    app.moving_left = False
+    app.moving_right = False
+    app.start_game = True
+    app.start_intro = True
+    app.intro_fade.fade_counter = 0
+    app.death_fade.fade_counter = 0
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summary(values):
+    return {
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values),
+    }
+
+
+def run_scenario(name, frames):
+    '''
+    Drive a scenario with the soak script or its recording, timing every frame and phase
+    '''
+    if name.startswith('long'):
+        compiled_long_level(int(name.split('_')[1]))
+    start_time = time.perf_counter()
+    load_scenario(name)
+    build_ms = (time.perf_counter() - start_time) * 1000
+    recording = app.playback
+    if recording is not None:
+        frames = recording.ticks
+        inputs = app.ScriptedInput()
+    else:
+        inputs = app.soak_script(frames)
+    frame_ms = []
+    phases = {}
+    deaths = 0
+    for frame in range(frames):
+        start_time = time.perf_counter()
+        app.step(inputs.get(frame))
+        frame_ms.append((time.perf_counter() - start_time) * 1000)
+        for phase, secs in app.phase_timer.phases.items():
+            phases.setdefault(phase, []).append(secs * 1000)
+        if not app.player.alive and recording is None:
+            # respawn without the death screen so every frame is gameplay
+            deaths += 1
+            load_scenario(name)
+    result = {
+        'frames': frames,
+        'build_ms': build_ms,
+        'deaths': deaths,
+        'frame_ms': summary(frame_ms),
+        'phases_ms': {phase: summary(values + [0] * (frames - len(values))) for phase, values in phases.items()},
+    }
+    if recording is not None:
+        result['replay_matches'] = app.state_digest() == recording.digest
+        app.playback = None
+    return result
+
+
+def measure_memory(name, frames):
+    '''
+    Peak traced Python allocations while building and playing a scenario
+    '''
+    tracemalloc.start()
+    try:
+        load_scenario(name)
+        if app.playback is not None:
+            frames = min(frames, app.playback.ticks)
+        inputs = app.soak_script(frames)
+        for frame in range(frames):
+            app.step(inputs.get(frame) if app.playback is None else [])
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+        app.playback = None
+
+
+def build_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Frame-time benchmark over real and synthetic levels')
+    parser.add_argument('--frames', type=int, default=1200, help='frames per scenario')
+    parser.add_argument('--memory-frames', type=int, default=300, help='frames of the traced memory pass, 0 to skip')
+    parser.add_argument('--scenarios', default=','.join(LEVELS + STRESS + LONG), help='comma separated, levelN, stress_<enemies>, long_<columns> or a recording')
+    parser.add_argument('--out', default='bench_results.json')
+    args = parser.parse_args(argv)
+
+    results = {'build': build_info(), 'scenarios': {}}
+    for name in args.scenarios.split(','):
+        result = run_scenario(name, args.frames)
+        if args.memory_frames:
+            result['peak_traced_kb'] = measure_memory(name, args.memory_frames)
+        result['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results['scenarios'][name] = result
+        frame_ms = result['frame_ms']
+        print(f"{name:12} p50 {frame_ms['p50']:6.2f}ms  p95 {frame_ms['p95']:6.2f}ms  p99 {frame_ms['p99']:6.2f}ms")
+        if result.get('replay_matches') is False:
+            print(f'{name} no longer plays back the recorded run')
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    app.prefetcher.wait()
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
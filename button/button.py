@@ -11,15 +11,22 @@ class Button():
 		self.rect = self.image.get_rect()
 		self.rect.topleft = (x, y)
 		self.clicked = False
+		#needs blitting -> set again whenever the area under the button is repainted
+		self.dirty = True
+		#disabled buttons are dimmed and ignore clicks
+		self.enabled = True
+		self.disabled_image = self.image.copy()
+		self.disabled_image.set_alpha(90)
 
-	def draw(self, surface):
+	def draw(self, surface, dirty_rects=None, pos=None):
 		action = False
 
-		#get mouse position
-		pos = pygame.mouse.get_pos()
+		#get mouse position, in surface coordinates when the surface is scaled to the window
+		if pos is None:
+			pos = pygame.mouse.get_pos()
 
 		#check mouseover and clicked conditions
-		if self.rect.collidepoint(pos):
+		if self.rect.collidepoint(pos) and self.enabled:
 			if pygame.mouse.get_pressed()[0] == 1 and self.clicked == False:
 				action = True
 				self.clicked = True
@@ -27,7 +34,11 @@ class Button():
 		if pygame.mouse.get_pressed()[0] == 0:
 			self.clicked = False
 
-		#draw button
-		surface.blit(self.image, (self.rect.x, self.rect.y))
+		#draw button, reporting the changed area the first time it appears
+		if self.dirty:
+			surface.blit(self.image if self.enabled else self.disabled_image, (self.rect.x, self.rect.y))
+			self.dirty = False
+			if dirty_rects is not None:
+				dirty_rects.append(self.rect)
 
 		return action
\ No newline at end of file
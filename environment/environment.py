@@ -0,0 +1,281 @@
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+# environments never open a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+import app
+
+# discrete actions -> keys held for the step, a/d/s stay down until an action drops them
+ACTIONS = (
+    (),                             # stand still
+    (pygame.K_a,),                  # run left
+    (pygame.K_d,),                  # run right
+    (pygame.K_w,),                  # jump
+    (pygame.K_a, pygame.K_w),       # jump left
+    (pygame.K_d, pygame.K_w),       # jump right
+    (pygame.K_SPACE,),              # attack
+    (pygame.K_s,),                  # crouch
+    (pygame.K_a, pygame.K_s),       # slide left
+    (pygame.K_d, pygame.K_s),       # slide right
+    (pygame.K_f,),                  # throw
+)
+HELD_KEYS = (pygame.K_a, pygame.K_d, pygame.K_s)
+# tile columns seen either side of the player
+VIEW_COLS = 16
+# nearest awake enemies reported, the rest of the rows are zero
+MAX_ENEMIES = 8
+# name -> shape, dtype of every observation array
+OBSERVATION = {
+    # tile ids around the player, -1 empty or off the level, entity spawn tiles blanked
+    'tiles': ((app.ROWS, 2 * VIEW_COLS), np.int8),
+    # x, y, hp, y velocity, in air, direction, attack cooldown
+    'player': ((7,), np.int32),
+    # dx, dy from the player, hp, kind, action, nearest first
+    'enemies': ((MAX_ENEMIES, 5), np.int32),
+}
+# reward per tile moved right, per hp gained or lost, for finishing and for dying
+PROGRESS_REWARD = 1 / app.TILE_SIZE
+HP_REWARD = 1 / 100
+LEVEL_REWARD = 100
+DEATH_REWARD = -50
+# entity spawn tiles are reported as entities, not tiles
+ENTITY_TILES = range(15, 20)
+
+
+class Env():
+    '''
+    Game loop as a programmatic environment -> one episode per level, nothing drawn unless asked
+    The game keeps its state in app's globals, so a process holds one environment
+    Episodes rarely reach the exit -> the next level is only prefetched when prefetch is set
+    '''
+    def __init__(self, level=1, seed=None, frame_skip=4, max_ticks=6000, prefetch=False):
+        self.level = level
+        self.frame_skip = frame_skip
+        self.max_ticks = max_ticks
+        self.prefetch = prefetch
+        app.prefetcher.enabled = prefetch
+        # episode seeds are drawn from here when reset is not given one
+        self.rng = random.Random(seed)
+        self.held = set()
+        self.x = 0
+        self.hp = 0
+
+    def reset(self, level=None, seed=None):
+        '''
+        Build a fresh world for a level -> first observation
+        '''
+        if level is not None:
+            self.level = level
+        app.seed = seed if seed is not None else self.rng.randrange(2 ** 32)
+        app.level = self.level
+        app.sim_ticks = 0
+        app.camera.reset()
+        app.world, app.player, app.health_bar = app.load_world(self.level)
+        if self.prefetch:
+            app.prefetcher.start(self.level + 1)
+        app.moving_left = False
+        app.moving_right = False
+        app.start_game = True
+        # fades only matter on screen
+        app.start_intro = False
+        app.intro_fade.fade_counter = 0
+        app.death_fade.fade_counter = 0
+        self.held = set()
+        self.x = app.player.rect.x
+        self.hp = app.player.hp
+        return self.observe()
+
+    def key_events(self, action):
+        '''
+        Key presses and releases that turn the held keys into the action's
+        '''
+        keys = ACTIONS[action]
+        events = [pygame.event.Event(pygame.KEYUP, key=key) for key in HELD_KEYS
+                  if key in self.held and key not in keys]
+        # w and space act on every press -> tapped each step they are in the action
+        events += [pygame.event.Event(pygame.KEYDOWN, key=key) for key in keys
+                   if key not in self.held]
+        self.held = set(keys) & set(HELD_KEYS)
+        return events
+
+    def step(self, action):
+        '''
+        Play an action for frame_skip ticks -> observation, reward, terminated, truncated, info
+        '''
+        events = self.key_events(action)
+        level_complete = False
+        for tick in range(self.frame_skip):
+            app.step(events, render=False)
+            events = []
+            level_complete = app.level != self.level
+            if level_complete or not app.player.alive:
+                break
+        reward = 0
+        if level_complete:
+            reward += LEVEL_REWARD
+        else:
+            reward += (app.player.rect.x - self.x) * PROGRESS_REWARD + (app.player.hp - self.hp) * HP_REWARD
+            if not app.player.alive:
+                reward += DEATH_REWARD
+        self.x = app.player.rect.x
+        self.hp = app.player.hp
+        terminated = level_complete or not app.player.alive
+        truncated = not terminated and app.sim_ticks >= self.max_ticks
+        info = {'level_complete': level_complete, 'ticks': app.sim_ticks}
+        return self.observe(), reward, terminated, truncated, info
+
+    def observe(self):
+        player = app.player
+        col = player.rect.centerx // app.TILE_SIZE
+        enemies = np.zeros(OBSERVATION['enemies'][0], dtype=np.int32)
+        # sleeping enemies are outside the zone's slice of the columns
+        manager = app.world.enemies
+        awake = slice(manager.zone.lo, manager.zone.hi)
+        columns = {name: manager.columns[name][awake] for name in ('alive', 'x', 'y', 'hp', 'kind', 'action')}
+        alive = np.flatnonzero(columns['alive'])
+        dx = columns['x'][alive] - player.rect.x
+        nearest = alive[np.argsort(np.abs(dx), kind='stable')[:MAX_ENEMIES]]
+        enemies[:len(nearest)] = np.stack((columns['x'][nearest] - player.rect.x, columns['y'][nearest] - player.rect.y,
+                                           columns['hp'][nearest], columns['kind'][nearest],
+                                           columns['action'][nearest]), 1)
+        return {
+            'tiles': tile_window(app.world, col - VIEW_COLS, 2 * VIEW_COLS),
+            'player': np.array([player.rect.x, player.rect.y, player.hp, round(player.y_velocity), player.in_air,
+                                player.direction, player.attack_cd], dtype=np.int32),
+            'enemies': enemies,
+        }
+
+    def render(self):
+        '''
+        Draw the current frame -> (height, width, 3) RGB array
+        '''
+        app.draw()
+        return pygame.surfarray.array3d(app.screen).transpose(1, 0, 2)
+
+    def close(self):
+        app.prefetcher.wait()
+
+
+def tile_window(world, first_col, cols):
+    '''
+    Tile ids of a column range, read from the loaded chunks
+    '''
+    window = np.full(OBSERVATION['tiles'][0], -1, dtype=np.int8)
+    for col in range(first_col - first_col % app.CHUNK_COLS, first_col + cols, app.CHUNK_COLS):
+        chunk = world.chunks.get(col // app.CHUNK_COLS)
+        if chunk is None:
+            continue
+        left = max(col, first_col)
+        right = min(col + app.CHUNK_COLS, first_col + cols)
+        window[:chunk.tiles.shape[0], left - first_col:right - first_col] = chunk.tiles[:, left - col:right - col]
+    window[(window >= ENTITY_TILES.start) & (window < ENTITY_TILES.stop)] = -1
+    return window
+
+
+def stack(observations):
+    return {name: np.stack([obs[name] for obs in observations]) for name in OBSERVATION}
+
+
+def worker(conn, level, seed, frame_skip, max_ticks):
+    '''
+    Serve one environment over a pipe, starting a new episode as soon as one ends
+    '''
+    env = Env(level, seed, frame_skip, max_ticks)
+    try:
+        while True:
+            command, data = conn.recv()
+            if command == 'step':
+                obs, reward, terminated, truncated, info = env.step(data)
+                if terminated or truncated:
+                    info['final_observation'] = obs
+                    obs = env.reset()
+                conn.send((obs, reward, terminated, truncated, info))
+            elif command == 'reset':
+                conn.send(env.reset(*data))
+            elif command == 'close':
+                break
+    finally:
+        env.close()
+        conn.close()
+
+
+class VecEnv():
+    '''
+    N independent environments, one process each -> observations batched into arrays
+    Finished episodes restart straight away, their last observation is in info['final_observation']
+    '''
+    def __init__(self, count, level=1, seed=None, frame_skip=4, max_ticks=6000):
+        self.count = count
+        # spawned workers import the game fresh instead of inheriting this process's window and threads
+        context = multiprocessing.get_context('spawn')
+        self.conns = []
+        self.processes = []
+        for i in range(count):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=worker, daemon=True,
+                                      args=(child_conn, level, None if seed is None else seed + i, frame_skip, max_ticks))
+            process.start()
+            child_conn.close()
+            self.conns.append(conn)
+            self.processes.append(process)
+
+    def __len__(self):
+        return self.count
+
+    def reset(self, level=None):
+        for conn in self.conns:
+            conn.send(('reset', (level,)))
+        return stack([conn.recv() for conn in self.conns])
+
+    def step(self, actions):
+        '''
+        Step every environment at once -> batched observations, rewards, terminated, truncated, infos
+        '''
+        for conn, action in zip(self.conns, actions):
+            conn.send(('step', int(action)))
+        results = [conn.recv() for conn in self.conns]
+        obs, rewards, terminated, truncated, infos = zip(*results)
+        return (stack(obs), np.array(rewards, dtype=np.float32), np.array(terminated), np.array(truncated),
+                list(infos))
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(('close', None))
+            conn.close()
+        for process in self.processes:
+            process.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Random agent throughput over N environment processes')
+    parser.add_argument('--envs', type=int, default=os.cpu_count())
+    parser.add_argument('--steps', type=int, default=2000, help='batched steps')
+    parser.add_argument('--level', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    envs = VecEnv(args.envs, args.level, args.seed)
+    envs.reset()
+    rng = np.random.default_rng(args.seed)
+    episodes = 0
+    start_time = time.perf_counter()
+    for i in range(args.steps):
+        obs, rewards, terminated, truncated, infos = envs.step(rng.integers(0, len(ACTIONS), args.envs))
+        episodes += int((terminated | truncated).sum())
+    elapsed = time.perf_counter() - start_time
+    envs.close()
+    steps = args.steps * args.envs
+    print(f'{args.envs} envs, {steps} steps in {elapsed:.2f}s ({steps / elapsed:.0f} steps/s), {episodes} episodes')
+    app.prefetcher.wait()
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,171 @@
+import bisect
+import csv
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+# magic, rows, cols, chunk width, spawn count, source csv mtime (ns)
+HEADER = struct.Struct('<4sHIHIq')
+MAGIC = b'LVL2'
+# player, enemies, item boxes and exit -> spawned as entities instead of tiles
+SPAWN_TILES = range(15, 21)
+# columns per chunk -> the unit levels are stored, loaded and released in
+CHUNK_COLS = 16
+
+
+class LevelData():
+    '''
+    Level held in memory -> flat tile grid plus entity spawns, handed out a chunk of columns at a time
+    '''
+    def __init__(self, rows, cols, tiles, spawns, chunk_cols=CHUNK_COLS):
+        self.rows = rows
+        self.cols = cols
+        self.chunk_cols = chunk_cols
+        # row major, one signed byte per cell, -1 is empty
+        self.tiles = tiles
+        # (tile, col, row) for every entity tile, ordered by column
+        self.spawns = sorted(spawns, key=lambda spawn: spawn[1])
+        self.spawn_cols = [spawn[1] for spawn in self.spawns]
+
+    @property
+    def chunk_count(self):
+        return (self.cols + self.chunk_cols - 1) // self.chunk_cols
+
+    def chunk_tiles(self, i):
+        '''
+        Row major tiles of a chunk, chunk_cols wide with -1 past the level's end
+        '''
+        left = i * self.chunk_cols
+        right = min(left + self.chunk_cols, self.cols)
+        tiles = array('b')
+        for y in range(self.rows):
+            tiles.extend(self.tiles[y * self.cols + left:y * self.cols + right])
+            tiles.extend([-1] * (left + self.chunk_cols - right))
+        return tiles
+
+    def chunk_spawns(self, i):
+        first = bisect.bisect_left(self.spawn_cols, i * self.chunk_cols)
+        last = bisect.bisect_left(self.spawn_cols, (i + 1) * self.chunk_cols)
+        return self.spawns[first:last]
+
+
+class MappedLevel(LevelData):
+    '''
+    Compiled level file memory mapped -> a chunk is only read when it is loaded
+    '''
+    def __init__(self, mm, rows, cols, chunk_cols, spawn_count):
+        self.mm = mm
+        self.rows = rows
+        self.cols = cols
+        self.chunk_cols = chunk_cols
+        self.chunk_size = rows * chunk_cols
+        # per chunk offsets into the spawn table, then the spawns ordered by column
+        self.index_start = HEADER.size + self.chunk_count * self.chunk_size
+        self.spawn_start = self.index_start + (self.chunk_count + 1) * 4
+
+    def chunk_tiles(self, i):
+        start = HEADER.size + i * self.chunk_size
+        tiles = array('b')
+        tiles.frombytes(self.mm[start:start + self.chunk_size])
+        return tiles
+
+    def chunk_spawns(self, i):
+        first, last = struct.unpack_from('<II', self.mm, self.index_start + i * 4)
+        spawn_data = array('i')
+        spawn_data.frombytes(self.mm[self.spawn_start + first * 12:self.spawn_start + last * 12])
+        if sys.byteorder == 'big':
+            spawn_data.byteswap()
+        return [tuple(spawn_data[j:j + 3]) for j in range(0, len(spawn_data), 3)]
+
+
+def compiled_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '.lvl'
+
+
+def compile_csv(csv_path, chunk_cols=CHUNK_COLS):
+    '''
+    Parse a level CSV into LevelData
+    '''
+    tiles = array('b')
+    cols = 0
+    with open(csv_path, newline='') as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        for row in reader:
+            cols = len(row)
+            tiles.extend(int(tile) for tile in row)
+    rows = len(tiles) // cols if cols else 0
+    spawns = []
+    for i, tile in enumerate(tiles):
+        if tile in SPAWN_TILES:
+            spawns.append((tile, i % cols, i // cols))
+    return LevelData(rows, cols, tiles, spawns, chunk_cols)
+
+
+def write_compiled(data, path, mtime):
+    index = array('I', [0])
+    spawns = array('i')
+    for i in range(data.chunk_count):
+        for spawn in data.chunk_spawns(i):
+            spawns.extend(spawn)
+        index.append(len(spawns) // 3)
+    if sys.byteorder == 'big':
+        index.byteswap()
+        spawns.byteswap()
+    # write then rename so a half written file is never loaded
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, data.rows, data.cols, data.chunk_cols, len(spawns) // 3, mtime))
+        # chunk major -> every chunk's tiles are one contiguous read
+        for i in range(data.chunk_count):
+            f.write(data.chunk_tiles(i).tobytes())
+        f.write(index.tobytes())
+        f.write(spawns.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_compiled(path, mtime, chunk_cols=CHUNK_COLS):
+    '''
+    Memory map a compiled level, None if missing, stale or chunked differently
+    '''
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+    with f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return None
+    if len(mm) < HEADER.size:
+        mm.close()
+        return None
+    magic, rows, cols, file_chunk_cols, spawn_count, source_mtime = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or source_mtime != mtime or file_chunk_cols != chunk_cols:
+        mm.close()
+        return None
+    data = MappedLevel(mm, rows, cols, chunk_cols, spawn_count)
+    if len(mm) != data.spawn_start + spawn_count * 12:
+        mm.close()
+        return None
+    return data
+
+
+def load(csv_path, chunk_cols=CHUNK_COLS):
+    '''
+    Open a level for streaming, recompiling the cached binary whenever the CSV has changed
+    '''
+    mtime = os.stat(csv_path).st_mtime_ns
+    path = compiled_path(csv_path)
+    data = read_compiled(path, mtime, chunk_cols)
+    if data is None:
+        data = compile_csv(csv_path, chunk_cols)
+        try:
+            write_compiled(data, path, mtime)
+        except OSError:
+            # read only install -> keep the parsed level in memory only
+            return data
+        data = read_compiled(path, mtime, chunk_cols) or data
+    return data
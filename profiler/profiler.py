@@ -0,0 +1,99 @@
+import time
+from array import array
+
+import pygame
+
+# loop phases in drawing order, names match app.PhaseTimer
+PHASES = ('events', 'stream', 'player', 'enemies', 'sprites', 'effects', 'fades', 'draw_bg', 'draw_world',
+          'draw_player', 'draw_enemies', 'draw_effects', 'draw_sprites', 'draw_fades', 'display')
+COLORS = ((200, 200, 200), (0, 255, 160), (0, 200, 255), (255, 80, 80), (255, 200, 0), (255, 120, 200),
+          (160, 160, 255), (0, 140, 0), (140, 90, 40), (0, 90, 255), (200, 0, 0), (255, 60, 160), (255, 140, 0),
+          (120, 0, 160), (255, 255, 255))
+# 60 FPS frame budget
+BUDGET_MS = 1000 / 60
+
+
+class Profiler():
+    '''
+    Per-phase frame timings kept in a fixed-size ring buffer with an overlay graph
+    '''
+    def __init__(self, size=200, height=100):
+        self.size = size
+        self.height = height
+        self.visible = False
+        # one preallocated column per phase -> recording never allocates
+        self.timings = {phase: array('f', [0] * size) for phase in PHASES}
+        self.entities = array('l', [0] * size)
+        self.blits = array('l', [0] * size)
+        self.quality = array('b', [0] * size)
+        self.index = 0
+        self.count = 0
+        self.surface = pygame.Surface((size, height + 32), pygame.SRCALPHA)
+        self.rect = self.surface.get_rect()
+        self.font = pygame.font.Font(None, 16)
+
+    def toggle(self):
+        self.visible = not self.visible
+
+    def record(self, phases, entities, blits, quality=0):
+        '''
+        Store a frame's phase timings (seconds) with its entity and blit counts and quality level
+        '''
+        for phase, column in self.timings.items():
+            column[self.index] = phases.get(phase, 0) * 1000
+        self.entities[self.index] = entities
+        self.blits[self.index] = blits
+        self.quality[self.index] = quality
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def ordered(self):
+        '''
+        Buffer slots from oldest to newest frame
+        '''
+        start = (self.index - self.count) % self.size
+        return [(start + i) % self.size for i in range(self.count)]
+
+    def frame_ms(self, slot):
+        return sum(column[slot] for column in self.timings.values())
+
+    def draw(self, surface, x, y):
+        '''
+        Stacked bar per frame, one colour per phase, with the frame budget line
+        '''
+        self.surface.fill((0, 0, 0, 170))
+        # graph spans twice the budget
+        scale = self.height / (BUDGET_MS * 2)
+        for i, slot in enumerate(self.ordered()):
+            top = self.height
+            for phase, color in zip(PHASES, COLORS):
+                bar = self.timings[phase][slot] * scale
+                if bar >= 1:
+                    pygame.draw.line(self.surface, color, (i, top - 1), (i, max(0, top - bar)))
+                top -= bar
+        budget_y = self.height - BUDGET_MS * scale
+        pygame.draw.line(self.surface, (255, 0, 0), (0, budget_y), (self.size, budget_y))
+        if self.count:
+            slot = (self.index - 1) % self.size
+            worst = max(PHASES, key=lambda phase: self.timings[phase][slot])
+            lines = (f'{self.frame_ms(slot):.1f}ms  entities {self.entities[slot]}  blits {self.blits[slot]}',
+                     f'worst {worst} {self.timings[worst][slot]:.1f}ms  quality -{self.quality[slot]}')
+            for i, line in enumerate(lines):
+                self.surface.blit(self.font.render(line, True, (255, 255, 255)), (2, self.height + 2 + i * 14))
+        self.rect.topleft = (x, y)
+        surface.blit(self.surface, self.rect)
+        return self.rect
+
+    def dump(self, path=None):
+        '''
+        Write the buffer to a CSV file, oldest frame first
+        '''
+        if path is None:
+            path = time.strftime('profile_%Y%m%d_%H%M%S.csv')
+        with open(path, 'w') as f:
+            f.write(','.join(('frame_ms',) + PHASES + ('entities', 'blits', 'quality')) + '\n')
+            for slot in self.ordered():
+                values = [f'{self.frame_ms(slot):.3f}'] + [f'{self.timings[phase][slot]:.3f}' for phase in PHASES]
+                f.write(','.join(values + [str(self.entities[slot]), str(self.blits[slot]),
+                                           str(self.quality[slot])]) + '\n')
+        return path
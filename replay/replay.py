@@ -0,0 +1,75 @@
+import os
+import struct
+import sys
+from array import array
+
+# magic, start level, seed, ticks played, final state digest, record count
+HEADER = struct.Struct('<4sHQIII')
+MAGIC = b'RPL1'
+
+
+class Recording():
+    '''
+    Recorded session -> seed, start level and every input code stamped with its tick
+    '''
+    def __init__(self, seed, level, ticks=0, digest=0, stamps=None, codes=None):
+        self.seed = seed
+        self.level = level
+        self.ticks = ticks
+        # digest of the game state chained over every tick up to the last, checked on playback
+        self.digest = digest
+        # codes stamped with tick N are applied before tick N + 1, in recorded order
+        self.stamps = stamps if stamps is not None else array('I')
+        self.codes = codes if codes is not None else array('B')
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.codes)
+
+    def add(self, tick, code):
+        self.stamps.append(tick)
+        self.codes.append(code)
+
+    def take(self, tick):
+        '''
+        Codes due before the tick after this one, each handed out once
+        '''
+        codes = []
+        while self.cursor < len(self.codes) and self.stamps[self.cursor] <= tick:
+            codes.append(self.codes[self.cursor])
+            self.cursor += 1
+        return codes
+
+
+def save(recording, path):
+    stamps = array('I', recording.stamps)
+    if sys.byteorder == 'big':
+        stamps.byteswap()
+    # write then rename so a half written file is never loaded
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, recording.level, recording.seed, recording.ticks, recording.digest,
+                            len(recording)))
+        f.write(stamps.tobytes())
+        f.write(recording.codes.tobytes())
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    '''
+    Read a recording, ValueError if it is not one
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f'{path} is not a recording')
+    magic, level, seed, ticks, digest, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or len(data) != HEADER.size + count * 5:
+        raise ValueError(f'{path} is not a recording')
+    stamps = array('I')
+    stamps.frombytes(data[HEADER.size:HEADER.size + count * 4])
+    if sys.byteorder == 'big':
+        stamps.byteswap()
+    codes = array('B')
+    codes.frombytes(data[HEADER.size + count * 4:])
+    return Recording(seed, level, ticks, digest, stamps, codes)